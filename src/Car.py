@@ -1,176 +1,276 @@
-# -*- coding: utf-8 -*-
-"""
-contains the 'Car' class, representing the agent in the racetrack problem. 
-the racetrack environment is stored as an attribute for the car 
-
-@name:          Car.py
-@author:        J. Tyler Leake
-@last update:   08-19-2024
-"""
-
-import numpy as np
-
-
-
-class Car:
-    
-    def __init__(self, Racetrack, crash_type = ['nearest', 'restart']):
-        
-        # agent's enviornment + attributes for crash/finish
-        self.env = Racetrack 
-        self.crash_type = crash_type
-        self.is_finished = False
-        
-        # agent's state values in the environment
-        self.X_velo = 0
-        self.Y_velo = 0
-        self.X_cord_cur = None
-        self.Y_cord_cur = None
-        self.X_cord_old = None
-        self.Y_cord_old = None
-        
-        self.restart_env() # initialize car at starting line
-
-    def restart_env(self):
-        '''
-        places the car at one of the starting points in the map
-        and sets the velocity to zero
-        '''
-        # reset the x/y velocities to zero and the old x/y coordinates 
-        # to none; set the is_finished attr. to False
-        self.X_velo = 0
-        self.Y_velo = 0
-        self.X_cord_old = None
-        self.Y_cord_old = None
-        self.is_finished = False
-        
-        # retrieve a random starting cordinate; set as current x/y coordinates
-        restart_cord = self.env.get_rand_start()
-        self.X_cord_cur, self.Y_cord_cur = restart_cord[0], restart_cord[1]
-        
-    def update_state(self, action):
-        '''
-        updates the coordinate and velocity state values of the 
-        car based on the action
-        
-        args: 
-        action (np arr): x/y acceleration action to apply to agent
-            
-        return:
-        none; agent's state values updated directly
-        '''
-        
-        X_accl, Y_accl = action[0], action[1]
-        
-        # store old x/y coordinates
-        self.X_cord_old, self.Y_cord_old = self.X_cord_cur, self.Y_cord_cur
-        
-        # compute the new velocity; assert it does not exceed speed limits
-        X_velo_new = self.X_velo + X_accl
-        Y_velo_new = self.Y_velo + Y_accl
-        self.X_velo = max(self.env.X_velo_dim[0],min(X_velo_new, self.env.X_velo_dim[1]))
-        self.Y_velo = max(self.env.Y_velo_dim[0],min(Y_velo_new, self.env.Y_velo_dim[1]))
-        
-        # update the car's coordinates state values
-        self.X_cord_cur += X_velo_new
-        self.Y_cord_cur += Y_velo_new
-        
-        self.check_if_finished() # check if car has reached finish line
-        self.crash_procedure() # run crash procedure
-        
-    def crash_procedure(self):
-        '''
-        determines if the agent has crashed in its environment. if True, 
-        place the car at either the nearest position or starting line
-        '''
-        cur_cords = (self.X_cord_cur, self.Y_cord_cur)
-        
-        # check if the car's coordinates are in a wall
-        in_wall = True if cur_cords in self.env.wall_cords else False
-        
-        # check if the car's coordinates are off of the map
-        exceeded_bounds = False
-        
-        if (self.X_cord_cur + 1 > self.env.X_cord_dim or self.X_cord_cur < 0) or \
-           (self.Y_cord_cur + 1 > self.env.Y_cord_dim or self.Y_cord_cur < 0):
-               
-            exceeded_bounds = True
-    
-        # if in a wall or off the map, place car according to crash policy
-        if in_wall or exceeded_bounds:
-            
-            # place at nearest coordinate in the track env.
-            if self.crash_type == 'nearest':
-                
-                cur_cords = np.array(cur_cords)
-                relief_cords = np.array(self.env.track_cords+self.env.start_cords)
-                relief_distances = np.sum(np.square(relief_cords-cur_cords), axis = 1)
-                    
-                min_relief_idx = np.argmin(relief_distances)
-                min_relief = relief_cords[min_relief_idx]
-                
-                # place the car the nearest track coordinate; reset speed
-                self.X_cord_old, self.Y_cord_old = None, None
-                self.X_cord_cur, self.Y_cord_cur = min_relief[0], min_relief[1] 
-                self.X_velo, self.Y_velo = 0, 0
-           
-            # place the car at the starting line; reset speed
-            if self.crash_type == 'restart':
-                self.restart_env()
-            
-    def check_if_finished(self):
-        '''
-        determines if the agent's current coordinates are in the finish 
-        line coordinates of the environment; updates 'is_finished' attr.
-        '''
-        crossed = False
-        within_fbounds = False
-        cur_cords = (self.X_cord_cur, self.Y_cord_cur)
-        old_cords = (self.X_cord_old, self.Y_cord_old)
-        
-        # vertical finish line 
-        if self.env.is_vert_finish:
-            
-            # compute the agent's distance to the finish line 
-            # before and after the action
-            dist_pre_act = (self.env.fbound1[1] - old_cords[1])
-            dist_pst_act = (self.env.fbound1[1] - cur_cords[1])
-            
-            # vertical test: if product of distances is negative, 
-            # then agent did pass vertically over the finish line
-            if (dist_pre_act * dist_pst_act) <= 0: 
-                
-                crossed = True 
-            
-                # horizontal test: if agent was within finish bounds before 
-                # or after crossing, then it crossed within the bounds
-                if (self.env.fbound1[0] <= old_cords[0] <= self.env.fbound2[0]) or \
-                   (self.env.fbound1[0] <= cur_cords[0] <= self.env.fbound2[0]):
-                       
-                       # within_fbounds = True
-                       # if crossed and within_bounds
-                       self.is_finished = True
-            
-        # horizontal finish line    
-        if not self.env.is_vert_finish: 
-            
-            # compute the agent's distance to the finish line 
-            # before and after the action
-            dist_pre_act = (self.env.fbound1[0] - old_cords[0])
-            dist_pst_act = (self.env.fbound1[0] - cur_cords[0])
-            
-            # horizontal test: if product of distances is negative, 
-            # then agent did pass horizontally over the finish line
-            if (dist_pre_act * dist_pst_act) <= 0: 
-                
-                crossed = True 
-            
-                # vertical test: if agent was within finish bounds before 
-                # or after crossing, then it crossed within the bounds
-                if (self.env.fbound1[1] <= old_cords[1] <= self.env.fbound2[1]) or \
-                   (self.env.fbound1[1] <= cur_cords[1] <= self.env.fbound2[1]):
-                       
-                       # within_fbounds = True
-                       # if crossed and within_bounds
-                       self.is_finished = True
-                       
+# -*- coding: utf-8 -*-
+"""
+contains the 'Car' class, representing the agent in the racetrack problem. 
+the racetrack environment is stored as an attribute for the car 
+
+@name:          Car.py
+@author:        J. Tyler Leake
+@last update:   08-19-2024
+"""
+
+import random
+from Racetrack import WALL
+from Profiler import profiler
+
+
+
+class Car:
+    
+    __slots__ = ('env', 'crash_type', 'is_finished', 'state', 'X_velo', 'Y_velo', 
+                 'X_cord_cur', 'Y_cord_cur', 'X_cord_old', 'Y_cord_old')
+    
+    def __init__(self, Racetrack, crash_type = ['nearest', 'restart']):
+        
+        # agent's enviornment + attributes for crash/finish
+        self.env = Racetrack 
+        self.crash_type = crash_type
+        self.is_finished = False
+        
+        # agent's state values in the environment
+        self.X_velo = 0
+        self.Y_velo = 0
+        self.X_cord_cur = None
+        self.Y_cord_cur = None
+        self.X_cord_old = None
+        self.Y_cord_old = None
+        
+        # packed state id of the car (see 'step'); kept in sync by 
+        # 'restart_env' and 'update_state'
+        self.state = None
+        
+        self.restart_env() # initialize car at starting line
+
+    def restart_env(self):
+        '''
+        places the car at one of the starting points in the map
+        and sets the velocity to zero
+        '''
+        # reset the x/y velocities to zero and the old x/y coordinates 
+        # to none; set the is_finished attr. to False
+        self.X_velo = 0
+        self.Y_velo = 0
+        self.X_cord_old = None
+        self.Y_cord_old = None
+        self.is_finished = False
+        
+        # retrieve a random starting cordinate; set as current x/y coordinates
+        restart_cord = self.env.get_rand_start()
+        self.X_cord_cur, self.Y_cord_cur = restart_cord[0], restart_cord[1]
+        self.state = int(self.env.encode_state(self.X_cord_cur, self.Y_cord_cur, 0, 0))
+        
+    def update_state(self, action):
+        '''
+        updates the coordinate and velocity state values of the 
+        car based on the action
+        
+        args: 
+        action (np arr): x/y acceleration action to apply to agent
+            
+        return:
+        none; agent's state values updated directly
+        '''
+        
+        # look the transition up in the environment's precomputed tables
+        # when available; else simulate the step directly
+        if self.env.next_state is not None:
+            self.update_state_from_table(action)
+            return
+        
+        X_accl, Y_accl = action[0], action[1]
+        
+        # store old x/y coordinates
+        self.X_cord_old, self.Y_cord_old = self.X_cord_cur, self.Y_cord_cur
+        
+        # compute the new velocity; assert it does not exceed speed limits
+        X_velo_new = self.X_velo + X_accl
+        Y_velo_new = self.Y_velo + Y_accl
+        self.X_velo = max(self.env.X_velo_dim[0],min(X_velo_new, self.env.X_velo_dim[1]))
+        self.Y_velo = max(self.env.Y_velo_dim[0],min(Y_velo_new, self.env.Y_velo_dim[1]))
+        
+        # update the car's coordinates state values
+        self.X_cord_cur += self.X_velo
+        self.Y_cord_cur += self.Y_velo
+        
+        self.check_if_finished() # check if car has reached finish line
+        self.crash_procedure() # run crash procedure
+        
+        # re-encode the packed state id, as the tables would: a car that 
+        # finished off the track is placed at the nearest track coordinate
+        pad = self.env.grid_pad
+        X_cord, Y_cord = self.X_cord_cur, self.Y_cord_cur
+        X_velo, Y_velo = self.X_velo, self.Y_velo
+        if self.env.occupancy[X_cord + pad, Y_cord + pad] <= WALL:
+            X_cord, Y_cord = self.env.relief_map[X_cord + pad, Y_cord + pad]
+            X_velo, Y_velo = 0, 0
+        self.state = int(self.env.encode_state(X_cord, Y_cord, X_velo, Y_velo))
+        
+        if profiler.enabled: 
+            profiler.count('steps')
+            if self.is_finished: profiler.count('finishes')
+        
+    def update_state_from_table(self, action):
+        '''
+        equivalent of 'update_state' that resolves the action with a 
+        single lookup into the environment's transition tables
+        '''
+        state = self.env.encode_state(self.X_cord_cur, self.Y_cord_cur, 
+                                      self.X_velo, self.Y_velo)
+        action_idx = self.env.action_idx[(action[0], action[1])]
+        next_state, finished, crashed = self.env.transition(state, action_idx)
+        
+        # store old x/y coordinates; crashes under the 'nearest' policy 
+        # are already relocated in the table
+        self.X_cord_old, self.Y_cord_old = self.X_cord_cur, self.Y_cord_cur
+        self.X_cord_cur, self.Y_cord_cur, self.X_velo, self.Y_velo = \
+            self.env.decode_state(next_state)
+        self.is_finished = bool(finished)
+        self.state = int(next_state)
+        
+        if crashed and not finished:
+            if self.crash_type == 'nearest':
+                self.X_cord_old, self.Y_cord_old = None, None
+            if self.crash_type == 'restart':
+                self.restart_env()
+        
+        if profiler.enabled: 
+            profiler.count('steps')
+            if finished: profiler.count('finishes')
+            elif crashed: profiler.count(f'crashes_{self.crash_type}')
+        
+    def step(self, action_idx):
+        '''
+        lean form of 'update_state' for the training loops: applies the 
+        action with the given index to the car's packed state id via the 
+        env's transition tables. only 'state' and 'is_finished' are 
+        updated; call 'sync_state_values' to refresh the x/y attributes. 
+        an env without tables falls back to 'update_state'
+        
+        args: 
+        action_idx (int): index of the action in the env's action list
+        
+        return: 
+        next state id, reward, finished flag
+        '''
+        env = self.env
+        
+        if env.next_state is None: 
+            self.update_state(env.actions[action_idx])
+            return self.state, (0 if self.is_finished else env.reward), self.is_finished
+        
+        state = env.next_state.item(self.state, action_idx)
+        finished = env.finished.item(self.state, action_idx)
+        crashed = not finished and env.crashed.item(self.state, action_idx)
+        
+        # crashes under the 'nearest' policy are relocated in the table
+        if crashed and self.crash_type == 'restart':
+            state = random.choice(env.start_states).item()
+        
+        self.state = state
+        self.is_finished = finished
+        
+        if profiler.enabled: 
+            profiler.count('steps')
+            if finished: profiler.count('finishes')
+            elif crashed: profiler.count(f'crashes_{self.crash_type}')
+        
+        return state, (0 if finished else env.reward), finished
+    
+    def sync_state_values(self):
+        '''
+        sets the car's coordinate and velocity attributes from its 
+        packed state id
+        '''
+        self.X_cord_cur, self.Y_cord_cur, self.X_velo, self.Y_velo = \
+            (int(val) for val in self.env.decode_state(self.state))
+        
+    def crash_procedure(self):
+        '''
+        determines if the agent has crashed in its environment. if True, 
+        place the car at either the nearest position or starting line
+        '''
+        # check if the car's coordinates are in a wall or off of the map; 
+        # a single step never leaves the padding of the occupancy grid
+        pad = self.env.grid_pad
+        crashed = self.env.occupancy[self.X_cord_cur + pad, self.Y_cord_cur + pad] <= WALL
+    
+        # if in a wall or off the map, place car according to crash policy
+        if crashed:
+            
+            if profiler.enabled and not self.is_finished: 
+                profiler.count(f'crashes_{self.crash_type}')
+            
+            # place at nearest coordinate in the track env.
+            if self.crash_type == 'nearest':
+                
+                min_relief = self.env.relief_map[self.X_cord_cur + pad, 
+                                                 self.Y_cord_cur + pad]
+                
+                # place the car the nearest track coordinate; reset speed
+                self.X_cord_old, self.Y_cord_old = None, None
+                self.X_cord_cur, self.Y_cord_cur = min_relief[0], min_relief[1] 
+                self.X_velo, self.Y_velo = 0, 0
+           
+            # place the car at the starting line; reset speed. a car that 
+            # crossed the finish line on this move is left finished
+            if self.crash_type == 'restart' and not self.is_finished:
+                self.restart_env()
+            
+    def check_if_finished(self):
+        '''
+        determines if the agent's current coordinates are in the finish 
+        line coordinates of the environment; updates 'is_finished' attr.
+        '''
+        crossed = False
+        within_fbounds = False
+        cur_cords = (self.X_cord_cur, self.Y_cord_cur)
+        old_cords = (self.X_cord_old, self.Y_cord_old)
+        
+        # vertical finish line 
+        if self.env.is_vert_finish:
+            
+            # compute the agent's distance to the finish line 
+            # before and after the action
+            dist_pre_act = (self.env.fbound1[1] - old_cords[1])
+            dist_pst_act = (self.env.fbound1[1] - cur_cords[1])
+            
+            # vertical test: if product of distances is negative, 
+            # then agent did pass vertically over the finish line
+            if (dist_pre_act * dist_pst_act) <= 0: 
+                
+                crossed = True 
+            
+                # horizontal test: if agent was within finish bounds before 
+                # or after crossing, then it crossed within the bounds
+                if (self.env.fbound1[0] <= old_cords[0] <= self.env.fbound2[0]) or \
+                   (self.env.fbound1[0] <= cur_cords[0] <= self.env.fbound2[0]):
+                       
+                       # within_fbounds = True
+                       # if crossed and within_bounds
+                       self.is_finished = True
+            
+        # horizontal finish line    
+        if not self.env.is_vert_finish: 
+            
+            # compute the agent's distance to the finish line 
+            # before and after the action
+            dist_pre_act = (self.env.fbound1[0] - old_cords[0])
+            dist_pst_act = (self.env.fbound1[0] - cur_cords[0])
+            
+            # horizontal test: if product of distances is negative, 
+            # then agent did pass horizontally over the finish line
+            if (dist_pre_act * dist_pst_act) <= 0: 
+                
+                crossed = True 
+            
+                # vertical test: if agent was within finish bounds before 
+                # or after crossing, then it crossed within the bounds
+                if (self.env.fbound1[1] <= old_cords[1] <= self.env.fbound2[1]) or \
+                   (self.env.fbound1[1] <= cur_cords[1] <= self.env.fbound2[1]):
+                       
+                       # within_fbounds = True
+                       # if crossed and within_bounds
+                       self.is_finished = True
+
+
+# methods timed while the profiler is enabled
+profiler.register(Car, 'update_state', 'step', 'check_if_finished', 'crash_procedure')
@@ -0,0 +1,102 @@
+# -*- coding: utf-8 -*-
+"""
+contains the 'Checkpoint' class, which backs the tables of a learner or
+planner with memory-mapped .npy files and snapshots them, with the
+scalar training state (episode counter, decayed rates, ...), so that an
+interrupted run can resume from the last snapshot
+
+@name:          Checkpoint.py
+@author:        J. Tyler Leake
+@last update:   08-19-2024
+"""
+
+import numpy as np
+import os
+import json
+
+
+
+class Checkpoint:
+
+    def __init__(self, checkpoint_dir):
+
+        # directory holding one .npy file per table, the snapshots of the
+        # tables + the state file
+        self.checkpoint_dir = checkpoint_dir
+        self.state_path = os.path.join(checkpoint_dir, 'state.json')
+        os.makedirs(checkpoint_dir, exist_ok = True)
+
+        # memory-mapped tables opened through this checkpoint
+        self.tables = {}
+
+        # number of the last snapshot; every save writes the next one
+        self.generation = 0
+        if os.path.exists(self.state_path):
+            with open(self.state_path) as state_file:
+                self.generation = json.load(state_file)['generation']
+
+    def table_path(self, name):
+        return os.path.join(self.checkpoint_dir, f'{name}.npy')
+
+    def snapshot_path(self, name, generation):
+        return os.path.join(self.checkpoint_dir, f'{name}-{generation}.npy')
+
+    def create_table(self, name, values):
+        '''
+        creates (or overwrites) the memory-mapped table 'name' holding a
+        copy of 'values'; returns the memmap to train on in place
+        '''
+        table = np.lib.format.open_memmap(self.table_path(name), mode = 'w+',
+                                          dtype = values.dtype, shape = values.shape)
+        table[...] = values
+        self.tables[name] = table
+        return table
+
+    def restore_table(self, name):
+        '''
+        resets the memory-mapped table 'name' to its last snapshot; returns
+        the memmap to train on in place
+        '''
+        snapshot = np.load(self.snapshot_path(name, self.generation), mmap_mode = 'r')
+        return self.create_table(name, snapshot)
+
+    def save(self, state):
+        '''
+        snapshots every open table, then writes the scalar training state.
+        the tables are trained on in place, so a snapshot is a copy of each
+        table. every file is written under a temporary name and then
+        replaced, and the state file names the snapshot it goes with, so
+        an interrupted save leaves the last checkpoint whole
+        '''
+        generation = self.generation + 1
+
+        for name, table in self.tables.items():
+            table.flush()
+            snapshot_path = self.snapshot_path(name, generation)
+            with open(snapshot_path + '.tmp', 'wb') as snapshot_file:
+                np.save(snapshot_file, table)
+            os.replace(snapshot_path + '.tmp', snapshot_path)
+
+        with open(self.state_path + '.tmp', 'w') as state_file:
+            json.dump({'generation' : generation, 'state' : state}, state_file)
+        os.replace(self.state_path + '.tmp', self.state_path)
+
+        # drop the snapshots the new state file replaced
+        for name in self.tables:
+            if os.path.exists(self.snapshot_path(name, self.generation)):
+                os.remove(self.snapshot_path(name, self.generation))
+        self.generation = generation
+
+    def load(self):
+        '''
+        returns the scalar training state of the last checkpoint, or
+        none if nothing has been checkpointed yet
+        '''
+        if not os.path.exists(self.state_path):
+            return None
+
+        with open(self.state_path) as state_file:
+            checkpoint = json.load(state_file)
+
+        self.generation = checkpoint['generation']
+        return checkpoint['state']
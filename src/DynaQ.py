@@ -0,0 +1,141 @@
+# -*- coding: utf-8 -*-
+"""
+contains implementation of the Dyna-Q algorithm for the racetrack
+problem as a class: Q-learning that also learns a model of the observed
+transitions and replays it. after every real step, a batch of planning
+updates drawn from the model is applied to the q_table at once
+
+@name:          DynaQ.py
+@author:        J. Tyler Leake
+@last update:   08-19-2024
+"""
+
+import numpy as np
+import time
+from QLearning import QLearning
+from Profiler import profiler
+
+
+
+class DynaQ(QLearning):
+
+    def __init__(self, Car, r_learning, r_discount, r_decay, p_explore,
+                 episodes = 10, max_itr = 1000, n_planning = 16,
+                 q_init = 'random', q_dtype = np.float64, q_sparse = False,
+                 metrics = None, checkpoint_dir = None, checkpoint_every = 100,
+                 model_capacity = 1024):
+
+        # planning batches index the q_table with arrays of states
+        if q_sparse:
+            raise ValueError('dyna-q planning needs a dense q_table')
+
+        super().__init__(Car, r_learning, r_discount, r_decay, p_explore,
+                         episodes, max_itr, q_init, q_dtype, q_sparse, metrics,
+                         checkpoint_dir, checkpoint_every)
+
+        # planning updates per real step
+        self.n_planning = n_planning
+
+        # model of the observed transitions: a dense index of the pair id
+        # (state * n_actions + action index) -> slot of the contiguous
+        # arrays (-1 if unseen), which double in capacity whenever they
+        # fill up. the index holds one int per pair, no more than the dense
+        # q_table dyna-q already needs. the last outcome observed for a
+        # pair is kept. the model is not checkpointed; training resumed
+        # from a checkpoint starts a new one
+        self.model_capacity = model_capacity
+        self.model_index = None
+        self.model_pairs = None
+        self.model_next = None
+        self.model_reward = None
+        self.model_finished = None
+        self.n_model = 0
+
+    def init_model(self):
+        '''
+        initializes an empty model of 'model_capacity' slots
+        '''
+        n_pairs = self.car.env.n_states * self.car.env.n_actions
+        index_dtype = np.int32 if n_pairs < 2**31 else np.int64
+        self.model_index = np.full(n_pairs, -1, dtype = index_dtype)
+        self.model_pairs = np.empty(self.model_capacity, dtype = np.int64)
+        self.model_next = np.empty(self.model_capacity, dtype = np.int64)
+        self.model_reward = np.empty(self.model_capacity, dtype = np.float64)
+        self.model_finished = np.empty(self.model_capacity, dtype = bool)
+        self.n_model = 0
+
+    def train(self, resume = False):
+        '''
+        implementation of the Dyna-Q algorithm: Q-learning (see
+        'QLearning.train') where every real step also updates the model
+        and applies 'n_planning' updates replayed from it. the model is
+        kept when training is resumed
+        '''
+        if not resume or self.model_index is None:
+            self.init_model()
+
+        super().train(resume)
+
+    def update(self, state, action_idx, reward, state_new, finished):
+        '''
+        one-step q-learning update from a real transition; the transition
+        is recorded in the model, then a batch of planning updates is
+        replayed from it
+        '''
+        super().update(state, action_idx, reward, state_new, finished)
+        self.record(state, action_idx, reward, state_new, finished)
+
+        if profiler.enabled: plan_start = time.perf_counter()
+        self.plan()
+        if profiler.enabled:
+            profiler.add_time('DynaQ.planning', time.perf_counter() - plan_start)
+
+    def record(self, state, action_idx, reward, state_new, finished):
+        '''
+        stores the outcome of a state/action pair in the model
+        '''
+        pair = state * self.car.env.n_actions + action_idx
+        slot = self.model_index.item(pair)
+
+        if slot == -1:
+            if self.n_model == len(self.model_pairs):
+                self.grow_model()
+            slot = self.n_model
+            self.model_index[pair] = slot
+            self.model_pairs[slot] = pair
+            self.n_model += 1
+
+        self.model_next[slot] = state_new
+        self.model_reward[slot] = reward
+        self.model_finished[slot] = finished
+
+    def grow_model(self):
+        '''
+        doubles the capacity of the model arrays
+        '''
+        for name in ('model_pairs', 'model_next', 'model_reward', 'model_finished'):
+            arr = getattr(self, name)
+            grown = np.empty(2 * len(arr), dtype = arr.dtype)
+            grown[:self.n_model] = arr[:self.n_model]
+            setattr(self, name, grown)
+
+    def plan(self):
+        '''
+        applies 'n_planning' q-learning updates to pairs drawn uniformly
+        from the model, as one batch: the targets are computed from the
+        q_table before any of the batch is applied, and a pair drawn more
+        than once in a batch is updated once
+        '''
+        if self.n_planning == 0:
+            return
+
+        slots = np.random.randint(self.n_model, size = self.n_planning)
+        states, action_idx = np.divmod(self.model_pairs[slots], self.car.env.n_actions)
+
+        # the finish line is terminal, so it has no next state value
+        next_vals = self.q_table[self.model_next[slots]].max(axis = 1)
+        next_vals[self.model_finished[slots]] = 0
+        q_targets = self.model_reward[slots] + self.r_discount * next_vals
+
+        q_vals = self.q_table[states, action_idx]
+        self.q_table[states, action_idx] = q_vals + self.r_learning * (q_targets - q_vals)
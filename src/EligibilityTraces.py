@@ -0,0 +1,63 @@
+# -*- coding: utf-8 -*-
+"""
+contains the 'EligibilityTraces' class, the eligibility traces of the
+lambda learners held as a bounded buffer of the most recently visited
+state/action pairs rather than a trace table the size of the q_table
+
+@name:          EligibilityTraces.py
+@author:        J. Tyler Leake
+@last update:   08-19-2024
+"""
+
+import numpy as np
+
+
+
+class EligibilityTraces:
+
+    def __init__(self, decay, cutoff = 0.01):
+
+        # the trace of a visit k steps ago is decay**k (discount * lambda);
+        # visits older than the first k with decay**k < 'cutoff' are dropped
+        if not 0 <= decay < 1:
+            raise ValueError('the trace decay (discount * lambda) must be in [0, 1)')
+        self.decay = decay
+        self.length = 1 if decay == 0 else max(1, int(np.ceil(np.log(cutoff) / np.log(decay))))
+
+        # trace of each active visit, oldest first
+        self.weights = decay ** np.arange(self.length)[::-1]
+
+        # ring buffer of the pair ids (state * n_actions + action index) of
+        # the last 'length' visits. every visit is written twice, 'length'
+        # slots apart, so that the active visits are always one contiguous
+        # slice of the buffer (oldest first)
+        self.pairs = np.zeros(2 * self.length, dtype = np.int64)
+        self.head = 0
+        self.n_active = 0
+
+    def clear(self):
+        '''
+        drops every active trace
+        '''
+        self.n_active = 0
+
+    def visit(self, pair):
+        '''
+        adds a visit of the pair id given; the oldest visit is dropped once
+        the buffer is full. a pair visited more than once has the sum of
+        the traces of its visits (accumulating traces)
+        '''
+        self.head = (self.head + 1) % self.length
+        self.pairs[self.head] = pair
+        self.pairs[self.head + self.length] = pair
+        self.n_active = min(self.n_active + 1, self.length)
+
+    def update(self, q_values, step):
+        '''
+        adds 'step' times its trace to the q-value of every active pair, in
+        one vectorized operation; 'q_values' is the q_table flattened to
+        one value per pair id
+        '''
+        end = self.head + self.length + 1
+        active = self.pairs[end - self.n_active:end]
+        np.add.at(q_values, active, step * self.weights[self.length - self.n_active:])
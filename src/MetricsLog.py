@@ -0,0 +1,145 @@
+# -*- coding: utf-8 -*-
+"""
+contains the 'MetricsLog' and 'MetricsReader' classes used to stream
+per-episode training metrics to disk as append-only chunks of columns,
+and to read them back lazily one column at a time
+
+@name:          MetricsLog.py
+@author:        J. Tyler Leake
+@last update:   08-19-2024
+"""
+
+import numpy as np
+import os
+import glob
+
+
+# per-episode record; each field is stored as its own column
+METRIC_FIELDS = {'episode'       : np.int64,
+                 'steps'         : np.int64,
+                 'return'        : np.float64,
+                 'epsilon'       : np.float64,
+                 'learning_rate' : np.float64,
+                 'wall_time'     : np.float64}
+
+
+
+class MetricsLog:
+
+    def __init__(self, log_dir, chunk_size = 10000):
+
+        # directory of chunk files; records are buffered in memory
+        # and written out every 'chunk_size' episodes
+        self.log_dir = log_dir
+        self.chunk_size = chunk_size
+        os.makedirs(log_dir, exist_ok = True)
+
+        # append after any chunks already in the directory
+        self.n_chunks = len(chunk_paths(log_dir))
+
+        self.buffer = {field: np.empty(chunk_size, dtype = dtype)
+                       for field, dtype in METRIC_FIELDS.items()}
+        self.n_buffered = 0
+
+    def append(self, episode, steps, ep_return, epsilon, learning_rate, wall_time):
+        '''
+        buffers the record of one episode; writes a chunk when full
+        '''
+        row = self.n_buffered
+        self.buffer['episode'][row] = episode
+        self.buffer['steps'][row] = steps
+        self.buffer['return'][row] = ep_return
+        self.buffer['epsilon'][row] = epsilon
+        self.buffer['learning_rate'][row] = learning_rate
+        self.buffer['wall_time'][row] = wall_time
+        self.n_buffered += 1
+
+        if self.n_buffered == self.chunk_size:
+            self.flush()
+
+    def reset(self):
+        '''
+        discards the buffered records and deletes the log's chunk files; 
+        used when a learner starts training from scratch
+        '''
+        for path in chunk_paths(self.log_dir):
+            os.remove(path)
+        self.n_chunks = 0
+        self.n_buffered = 0
+
+    def truncate(self, n_chunks):
+        '''
+        discards the buffered records and deletes the chunk files written 
+        after the first 'n_chunks'; used when a learner resumes from a 
+        checkpoint, so the episodes it replays are not logged twice
+        '''
+        for path in chunk_paths(self.log_dir)[n_chunks:]:
+            os.remove(path)
+        self.n_chunks = min(n_chunks, len(chunk_paths(self.log_dir)))
+        self.n_buffered = 0
+
+    def flush(self):
+        '''
+        writes the buffered records to the next chunk file. the chunk is
+        written to a temporary file first, so a run that dies mid-write
+        never leaves a partial chunk behind
+        '''
+        if self.n_buffered == 0:
+            return
+
+        columns = {field: column[:self.n_buffered] for field, column in self.buffer.items()}
+        path = os.path.join(self.log_dir, f'chunk_{self.n_chunks:06d}.npz')
+
+        with open(path + '.tmp', 'wb') as chunk_file:
+            np.savez(chunk_file, **columns)
+        os.replace(path + '.tmp', path)
+
+        self.n_chunks += 1
+        self.n_buffered = 0
+
+
+
+class MetricsReader:
+
+    def __init__(self, log_dir):
+
+        self.log_dir = log_dir
+
+    def iter_column(self, field):
+        '''
+        yields the values of a metric one chunk at a time; only that
+        field is read from each chunk
+        '''
+        for path in chunk_paths(self.log_dir):
+            with np.load(path) as chunk:
+                yield chunk[field]
+
+    def column(self, field):
+        '''
+        returns all values of a metric (e.g. the 'steps' learning curve)
+        '''
+        columns = list(self.iter_column(field))
+        if not columns:
+            return np.empty(0, dtype = METRIC_FIELDS[field])
+        return np.concatenate(columns)
+
+    def mean(self, field):
+        '''
+        returns the mean of a metric, streaming over the chunks
+        '''
+        total, count = 0.0, 0
+        for values in self.iter_column(field):
+            total += values.sum()
+            count += len(values)
+        return float(total / count)
+
+    def __len__(self):
+        return sum(len(values) for values in self.iter_column('episode'))
+
+
+
+def chunk_paths(log_dir):
+    '''
+    returns the paths of the chunk files of a metrics log in write order
+    '''
+    return sorted(glob.glob(os.path.join(log_dir, 'chunk_*.npz')))
@@ -0,0 +1,166 @@
+# -*- coding: utf-8 -*-
+"""
+contains implementation of the coarse-to-fine (multi-resolution) value
+iteration planner for the racetrack problem as a class. the track is
+downsampled into coarser levels; each level is solved by value iteration
+warm-started from the values of the level below it, ending with the full
+resolution track
+
+@name:          MultiResolutionVI.py
+@author:        J. Tyler Leake
+@last update:   08-19-2024
+"""
+
+import numpy as np
+import os
+import tempfile
+from Racetrack import Racetrack, START, FINISH
+from Car import Car
+from ValueIteration import ValueIteration
+from track_generator import downsample_track, write_track
+
+
+
+class MultiResolutionVI(ValueIteration):
+
+    def __init__(self, car, theta, r_discount, max_itr = 100, factors = (4, 2),
+                 sweep_mode = 'gauss-seidel', v_init = None):
+
+        # gauss-seidel sweeps by default: they carry a warm start across the
+        # track in a few sweeps, where synchronous sweeps still spread any
+        # correction one step per sweep
+        super().__init__(car, theta, r_discount, max_itr, sweep_mode = sweep_mode)
+
+        # downsampling factors of the coarse levels, solved coarsest first;
+        # a factor k merges every k x k block of cells into one
+        self.factors = sorted(set(factors) - {1}, reverse = True)
+
+        # warm start of the state values; zeros if none
+        self.v_init = v_init
+
+        # sweeps done at every level, keyed by factor (1 is the full
+        # resolution track); see 'train'
+        self.level_sweeps = {}
+        self.level_states = {}
+
+    def init_v_table(self):
+        '''
+        initializes the state value table from the warm start, if any
+        '''
+        if self.v_init is None:
+            return super().init_v_table()
+        return self.v_init.copy()
+
+    def build_level(self, factor, track_dir):
+        '''
+        returns the racetrack downsampled by 'factor', with its velocity
+        limits scaled down to match (at least 1), written as a track file
+        into 'track_dir'; none if the coarse track has lost its start or
+        finish line or cannot reach the finish line from the start
+        '''
+        env = self.env
+        pad = env.grid_pad
+        track = env.occupancy[pad:pad + env.X_cord_dim, pad:pad + env.Y_cord_dim]
+
+        coarse_track = downsample_track(track, factor)
+        if not (coarse_track == START).any() or not (coarse_track == FINISH).any():
+            return None
+
+        track_path = os.path.join(track_dir, f'level-{factor}.txt')
+        write_track(track_path, coarse_track)
+
+        accls = np.array(env.actions)
+        X_velo_max = max(1, max(np.abs(env.X_velo_dim)) // factor)
+        Y_velo_max = max(1, max(np.abs(env.Y_velo_dim)) // factor)
+
+        coarse_env = Racetrack(track_path, env.p_transition, env.reward,
+                               accl_range = (accls.min(), accls.max()),
+                               X_velo_range = (-X_velo_max, X_velo_max),
+                               Y_velo_range = (-Y_velo_max, Y_velo_max))
+
+        start_cords = np.array(coarse_env.start_cords)
+        start_cells = coarse_env.state_index.cell_index[start_cords[:, 0], start_cords[:, 1]]
+        if not np.isfinite(coarse_env.get_finish_distance()[start_cells]).any():
+            return None
+
+        return coarse_env
+
+    def upsample_values(self, coarse_env, coarse_v_table, coarse_factor,
+                        fine_env, fine_factor):
+        '''
+        returns the state values of 'fine_env' interpolated (nearest
+        neighbor) from those of the coarser 'coarse_env': every fine state
+        takes the value of the coarse cell it lies in, at its velocity
+        scaled by the ratio of the factors. a fine cell inside a coarse
+        wall takes the nearest coarse track cell
+        '''
+        states = np.arange(fine_env.n_states)
+        X_cord, Y_cord, X_velo, Y_velo = fine_env.decode_state(states)
+
+        X_cord = X_cord * fine_factor // coarse_factor
+        Y_cord = Y_cord * fine_factor // coarse_factor
+
+        in_wall = coarse_env.state_index.cell_index[X_cord, Y_cord] < 0
+        X_cord[in_wall], Y_cord[in_wall] = \
+            coarse_env.nearest_relief(X_cord[in_wall], Y_cord[in_wall])
+
+        scale = fine_factor / coarse_factor
+        X_velo = np.clip(np.rint(X_velo * scale), *coarse_env.X_velo_dim).astype(np.int64)
+        Y_velo = np.clip(np.rint(Y_velo * scale), *coarse_env.Y_velo_dim).astype(np.int64)
+
+        return coarse_v_table[coarse_env.encode_state(X_cord, Y_cord, X_velo, Y_velo)]
+
+    def train(self):
+        '''
+        implementation of coarse-to-fine value iteration. every coarse
+        level (coarsest first) is solved by value iteration warm-started
+        from the level before it; the full resolution track is then solved
+        from the values of the finest coarse level. levels whose coarse
+        track cannot be raced are skipped. 'training_results' holds the
+        sweeps of the full resolution solve; 'level_sweeps' those of every
+        level
+        '''
+        self.level_sweeps = {}
+        self.level_states = {}
+        v_init = self.v_init
+        coarse = None
+
+        with tempfile.TemporaryDirectory() as track_dir:
+
+            for factor in self.factors:
+
+                env = self.build_level(factor, track_dir)
+                if env is None:
+                    continue
+
+                level = MultiResolutionVI(Car(env, self.car.crash_type), self.theta,
+                                          self.r_discount, self.max_itr, factors = (),
+                                          sweep_mode = self.sweep_mode)
+                if coarse is not None:
+                    level.v_init = self.upsample_values(coarse.env, coarse.v_table,
+                                                        coarse_factor, env, factor)
+                level.train()
+
+                self.level_sweeps[factor] = len(level.training_results)
+                self.level_states[factor] = env.n_states
+                coarse, coarse_factor = level, factor
+
+        # solve the full resolution track from the finest coarse level
+        if coarse is not None:
+            self.v_init = self.upsample_values(coarse.env, coarse.v_table,
+                                               coarse_factor, self.env, 1)
+        super().train()
+        self.v_init = v_init
+
+        self.level_sweeps[1] = len(self.training_results)
+        self.level_states[1] = self.env.n_states
+
+    def total_sweeps(self):
+        '''
+        returns the sweeps done over all levels, and their cost in full
+        resolution sweeps (every sweep weighted by the states of its level)
+        '''
+        n_sweeps = sum(self.level_sweeps.values())
+        cost = sum(self.level_sweeps[factor] * self.level_states[factor]
+                   for factor in self.level_sweeps) / self.env.n_states
+        return n_sweeps, cost
@@ -0,0 +1,92 @@
+# -*- coding: utf-8 -*-
+"""
+contains functions to compile a trained table into a greedy policy
+artifact (an int8 action index per state) and to evaluate a policy
+with batched rollouts over the environment's transitions
+
+@name:          Policy.py
+@author:        J. Tyler Leake
+@last update:   08-19-2024
+"""
+
+import numpy as np
+
+
+
+def export_policy(learner, path = None):
+    '''
+    compiles the greedy policy of a trained learner/planner into an int8
+    array holding the action index to take in each state. the policy
+    table of a planner is used as is; otherwise the (dense or sparse) 
+    q_table argmax. if 'path' is given, the policy is also saved there 
+    as a .npy file
+    '''
+    if getattr(learner, 'p_table', None) is not None:
+        policy = np.asarray(learner.p_table).astype(np.int8)
+    else:
+        policy = np.asarray(learner.q_table.argmax(axis = 1)).astype(np.int8)
+
+    if path is not None:
+        np.save(path, policy)
+
+    return policy
+
+
+def load_policy(path):
+    '''
+    loads a policy saved by 'export_policy'
+    '''
+    return np.load(path)
+
+
+def rollout(env, policy, crash_type = ['nearest', 'restart'], n_episodes = 10,
+            max_itr = 500, stochastic = True, rng = None):
+    '''
+    evaluates a policy by running 'n_episodes' episodes from every start
+    cell in lockstep. with 'stochastic', the env's transition probability
+    applies (the car does nothing with probability 1 - p_transition).
+
+    args:
+    env (Racetrack): environment; without transition tables, the moves 
+    are simulated (see 'Racetrack.transition')
+    policy (np arr): action index per state (see 'export_policy')
+    rng (np.random.Generator): if none, seeded from numpy's global state
+
+    return:
+    np arr of shape (n start cells, n_episodes) of the steps taken to
+    finish; episodes that do not finish within 'max_itr' count 'max_itr'
+    '''
+    if rng is None:
+        rng = np.random.default_rng(np.random.randint(2**31))
+
+    noop_idx = env.action_idx[(0, 0)]
+    n_starts = len(env.start_states)
+
+    # one entry per episode; 'active' holds the unfinished episodes
+    states = np.repeat(env.start_states, n_episodes)
+    steps = np.full(len(states), max_itr, dtype = np.int64)
+    active = np.arange(len(states))
+
+    for itr in range(max_itr):
+
+        cur_states = states[active]
+        action_idx = policy[cur_states].astype(np.int64)
+        if stochastic:
+            action_idx[rng.random(len(active)) > env.p_transition] = noop_idx
+
+        next_states, finished, crashed = env.transition(cur_states, action_idx)
+
+        # place crashed cars at the starting line under 'restart'
+        if crash_type == 'restart':
+            restarts = crashed & ~finished
+            next_states = next_states.copy()
+            next_states[restarts] = rng.choice(env.start_states, size = np.count_nonzero(restarts))
+
+        states[active] = next_states
+        steps[active[finished]] = itr + 1
+        active = active[~finished]
+
+        if len(active) == 0:
+            break
+
+    return steps.reshape(n_starts, n_episodes)
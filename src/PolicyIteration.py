@@ -0,0 +1,248 @@
+# -*- coding: utf-8 -*-
+"""
+contains implementation of the policy iteration algorithm for the
+racetrack problem as a class. the transition model is a sparse matrix
+built from the environment's transition tables; each policy is evaluated
+by repeated backups to a tolerance (or with a sparse linear solve)
+
+@name:          PolicyIteration.py
+@author:        J. Tyler Leake
+@last update:   08-19-2024
+"""
+
+import numpy as np
+import scipy.sparse as sp
+from scipy.sparse.linalg import spsolve
+from Car import *
+from Profiler import profiler
+
+
+
+class PolicyIteration:
+
+    def __init__(self, car, theta, r_discount, max_itr = 100,
+                 evaluation = 'iterative', eval_tol = 1e-6,
+                 eval_max_itr = 1000):
+
+        # racetrack environment to train on
+        self.car = car
+        self.env = car.env
+
+        # state value table; action-value table; and policy table
+        self.v_table = None
+        self.q_table = None
+        self.p_table = None
+
+        # sparse transition model; see 'build_model'
+        self.model = None
+        self.model_rewards = None
+
+        # model stopping criteria: either convergence threshold on the
+        # state values, a stable policy or max number of iterations
+        self.theta = theta
+        self.max_itr = max_itr
+        self.r_discount = r_discount
+
+        # policy evaluation: 'iterative' backups until the values change 
+        # by less than 'eval_tol', or an 'exact' sparse solve. each policy 
+        # is evaluated from the values of the last, so a few backups 
+        # suffice; the solve's fill-in grows quickly with the track 
+        # (~30s per solve on a 150x150 track)
+        self.evaluation = evaluation
+        self.eval_tol = eval_tol
+        self.eval_max_itr = eval_max_itr
+
+        # results
+        self.training_results = 0
+        self.test_results = {}
+
+    def build_model(self):
+        '''
+        builds the deterministic transition model as a sparse matrix of
+        shape (n_states * n_actions, n_states): row s * n_actions + a
+        holds the distribution of the state reached by taking action a in
+        state s. finishing moves are terminal (empty rows); under the
+        'restart' crash policy a crash spreads over the start states.
+        'model_rewards' holds the reward of each row
+        '''
+        env = self.env
+
+        if env.next_state is None:
+            env.build_transition_tables()
+
+        n_pairs = env.n_states * env.n_actions
+        finished = env.finished.ravel()
+        next_state = env.next_state.ravel()
+
+        moves = ~finished
+        if self.car.crash_type == 'restart':
+            restarts = env.crashed.ravel() & moves
+            moves &= ~restarts
+
+        rows = [np.flatnonzero(moves)]
+        cols = [next_state[moves]]
+        vals = [np.ones(len(rows[0]))]
+
+        if self.car.crash_type == 'restart':
+            n_starts = len(env.start_states)
+            restart_rows = np.flatnonzero(restarts)
+            rows.append(np.repeat(restart_rows, n_starts))
+            cols.append(np.tile(env.start_states, len(restart_rows)))
+            vals.append(np.full(len(restart_rows) * n_starts, 1 / n_starts))
+
+        self.model = sp.csr_matrix((np.concatenate(vals),
+                                    (np.concatenate(rows), np.concatenate(cols))),
+                                   shape = (n_pairs, env.n_states))
+        self.model_rewards = np.where(finished, 0.0, env.reward)
+
+    def train(self):
+        '''
+        implementation of the policy iteration algorithm. alternates
+        between evaluating the current policy and improving it greedily
+        until the policy is stable, the state values change by less than
+        'theta' or 'max_itr' iterations are done
+        '''
+        env = self.env
+
+        if self.model is None:
+            self.build_model()
+
+        # initialize the state value table V(s); the action-value
+        # table Q(s); and policy table P (action indices)
+        self.v_table = np.zeros(env.n_states)
+        self.q_table = np.zeros((env.n_states, env.n_actions))
+        self.p_table = np.zeros(env.n_states, dtype = np.int64)
+        self.training_results = {}
+
+        itr = 0
+        done = False
+
+        while not done:
+
+            v_table = self.evaluate_policy()
+            max_v_delta = np.max(np.abs(v_table - self.v_table))
+            self.v_table = v_table
+
+            policy_stable = self.improve_policy()
+
+            # stopping criteria
+            self.training_results[itr] = max_v_delta
+            itr += 1
+            done = policy_stable or max_v_delta <= self.theta or itr >= self.max_itr
+
+    def policy_model(self):
+        '''
+        returns the transition matrix and expected rewards of the current
+        policy: the chosen action applies with p_transition, else nothing
+        '''
+        env = self.env
+        p = env.p_transition
+
+        states = np.arange(env.n_states)
+        policy_rows = states * env.n_actions + self.p_table
+        noop_rows = states * env.n_actions + env.action_idx[(0, 0)]
+
+        transitions = p * self.model[policy_rows] + (1 - p) * self.model[noop_rows]
+        rewards = p * self.model_rewards[policy_rows] + \
+                  (1 - p) * self.model_rewards[noop_rows]
+
+        return transitions, rewards
+
+    def evaluate_policy(self):
+        '''
+        returns the state values of the current policy, the solution of
+        V = R + discount * P V; either solved exactly or by repeated
+        backups starting from the current values
+        '''
+        transitions, rewards = self.policy_model()
+
+        if self.evaluation == 'exact':
+            system = sp.identity(self.env.n_states, format = 'csc') - \
+                     self.r_discount * transitions.tocsc()
+            return spsolve(system, rewards)
+
+        v_table = self.v_table.copy()
+        for _ in range(self.eval_max_itr):
+            v_new = rewards + self.r_discount * (transitions @ v_table)
+            delta = np.max(np.abs(v_new - v_table))
+            v_table = v_new
+            if delta < self.eval_tol:
+                break
+
+        return v_table
+
+    def improve_policy(self):
+        '''
+        updates the action-value and policy tables greedily from the
+        state values; returns true if the policy did not change. an action
+        is only replaced by a strictly better one, so ties cannot cycle
+        '''
+        env = self.env
+        p = env.p_transition
+        noop_idx = env.action_idx[(0, 0)]
+
+        # one-step backup of each state/action pair; the expected q-value
+        # under the transition probability mixes in the no-op backup
+        backups = self.model_rewards + self.r_discount * (self.model @ self.v_table)
+        backups = backups.reshape(env.n_states, env.n_actions)
+        self.q_table[:] = p * backups + (1 - p) * backups[:, noop_idx, None]
+
+        states = np.arange(env.n_states)
+        max_q_vals = self.q_table.max(axis = 1)
+        tie_tol = 1e-9 if self.evaluation == 'exact' else self.eval_tol
+
+        improved = max_q_vals > self.q_table[states, self.p_table] + tie_tol
+        self.p_table[improved] = self.q_table[improved].argmax(axis = 1)
+
+        return not improved.any()
+
+    def test(self):
+        '''
+        testing simulator for the algorithm. executes the learned policy from
+        training on a fresh raceterack environment.
+        '''
+        self.car.restart_env() # reset the car's state; place at starting line
+
+        # iterate until either the agent has reached the finish
+        # line or the 'max_itr' is hit
+
+        test_itr = 0
+        done = False
+
+        while not done:
+
+            # retrive the current state of the car
+            X_cord = self.car.X_cord_cur
+            Y_cord = self.car.Y_cord_cur
+            X_velo = self.car.X_velo
+            Y_velo = self.car.Y_velo
+
+            s = (X_cord, Y_cord, X_velo, Y_velo)
+
+            # retieve the action from the policy and perform it
+            state = self.env.encode_state(X_cord, Y_cord, X_velo, Y_velo)
+            action = self.env.actions[self.p_table[state]]
+            self.car.update_state(action)
+
+            # retrive the next state of the car
+            X_cord = self.car.X_cord_cur
+            Y_cord = self.car.Y_cord_cur
+            X_velo = self.car.X_velo
+            Y_velo = self.car.Y_velo
+
+            s_prime = (X_cord, Y_cord, X_velo, Y_velo)
+
+            # stopping criteria: check if car has finished or if the
+            # max_itr has been hit; if true, terminate
+            test_itr += 1
+            if self.car.is_finished: done = True
+            if test_itr >= 500: done = True
+
+            print(s, action, s_prime)
+
+        # record the number of steps taken in this test run
+        self.test_results[len(self.test_results)] = test_itr
+
+
+# methods timed while the profiler is enabled
+profiler.register(PolicyIteration, 'evaluate_policy', 'improve_policy')
@@ -0,0 +1,284 @@
+# -*- coding: utf-8 -*-
+"""
+contains implementation of the prioritized sweeping planner for the
+racetrack problem as a class. rather than backing up every state each
+sweep, it only updates the states whose bellman residual exceeds the
+stopping threshold, best tentative value first (in batches), and only
+requeues the predecessors of states whose value changed
+
+@name:          PrioritizedSweeping.py
+@author:        J. Tyler Leake
+@last update:   08-19-2024
+"""
+
+import numpy as np
+from ValueIteration import ValueIteration
+from Profiler import profiler
+
+
+
+class PrioritizedSweeping(ValueIteration):
+
+    def __init__(self, car, theta, r_discount, max_itr = 100, bucket_width = 4):
+
+        # the value, action-value and policy tables and the one-step
+        # backup are those of value iteration
+        super().__init__(car, theta, r_discount, max_itr)
+
+        # the queue buckets states by their tentative value, each bucket
+        # spanning 'bucket_width' steps' worth of reward; a batch updates a
+        # whole bucket (narrower buckets order the updates more closely
+        # but give more, smaller batches)
+        self.bucket_width = bucket_width
+
+        # predecessor edges of every state; see 'build_predecessors'
+        self.pred_ptr = None
+        self.pred_pairs = None
+
+        # number of state value updates made by 'train'
+        self.n_backups = 0
+
+    def init_v_table(self):
+        '''
+        initializes every state value to the value of never finishing (a
+        lower bound on the true values). a backup leaves these values as
+        they are except where the finish line can be reached, so only
+        those states start queued and values spread back from the finish
+        '''
+        return np.full(self.env.n_states, self.env.reward / (1 - self.r_discount))
+
+    def build_predecessors(self, restarts):
+        '''
+        builds the predecessor edges of every state from the transition
+        tables, as compressed rows: row s of 'pred_pairs' holds the
+        state/action pairs (as state * n_actions + action index) whose
+        action lands in s. under the 'restart' crash policy, the pairs that
+        crash depend on the mean value of the start states instead; they
+        have no edges (see 'train')
+        '''
+        env = self.env
+
+        moves = ~env.finished
+        if restarts is not None:
+            moves &= ~restarts
+
+        pairs = np.flatnonzero(moves)
+        successors = env.next_state.ravel()[pairs]
+        counts = np.bincount(successors, minlength = env.n_states)
+        self.pred_ptr = np.concatenate(([0], np.cumsum(counts)))
+        self.pred_pairs = pairs[np.argsort(successors, kind = 'stable')]
+
+    def gather(self, states):
+        '''
+        returns the predecessor pairs of the states given and the number of
+        each state
+        '''
+        starts = self.pred_ptr[states]
+        counts = self.pred_ptr[states + 1] - starts
+        offsets = np.repeat(starts - np.cumsum(counts) + counts, counts)
+        return self.pred_pairs[offsets + np.arange(len(offsets))], counts
+
+    def first_occurrences(self, states, stamps):
+        '''
+        returns the state ids given without repeats (first occurrences, in
+        order); 'stamps' is scratch space of one int per state
+        '''
+        positions = np.arange(len(states))
+        stamps[states[::-1]] = positions[::-1]
+        return states[stamps[states] == positions]
+
+    def queue_states(self, states, values, buckets, queued_bucket):
+        '''
+        queues the states given in the bucket of the tentative values
+        given, where that is above the bucket they are queued in. bucket b
+        holds the values from b bucket widths above the initial value up
+        '''
+        width = self.bucket_width * abs(self.env.reward)
+        v_init = self.env.reward / (1 - self.r_discount)
+        state_buckets = ((values - v_init) / width).astype(np.int64)
+        state_buckets = np.clip(state_buckets, 0, len(buckets) - 1)
+
+        moved = state_buckets > queued_bucket[states]
+        states, state_buckets = states[moved], state_buckets[moved]
+        queued_bucket[states] = state_buckets
+
+        for b in np.flatnonzero(np.bincount(state_buckets, minlength = len(buckets))):
+            buckets[b].append(states[state_buckets == b])
+
+    def train(self):
+        '''
+        implementation of prioritized sweeping, ordered by value. every
+        state whose bellman residual (largest q-value less state value)
+        exceeds 'theta' is queued by its largest q-value; each batch
+        updates the queued states of the top value bucket (see
+        'bucket_width') to their largest q-value. values only rise from
+        their lower bound (see 'init_v_table'), so taking the best values
+        first settles the states near the finish line before the states
+        that lead to them, as in a shortest path search, and most states
+        are updated only a few times. the one-step backups of every action
+        (see 'action_backups') are kept exact as the values change, by
+        adding each value change to those of the predecessor pairs (see
+        'build_predecessors'), so the residuals of the touched
+        predecessors are exact. a stopped car whose no-op lands back on
+        itself is solved exactly for its own value. training stops once no
+        residual exceeds 'theta' (the stopping criterion of value
+        iteration), or after 'max_itr' full sweeps' worth of updates
+        '''
+        env = self.env
+        p = env.p_transition
+        noop_idx = env.action_idx[(0, 0)]
+
+        if env.next_state is None:
+            env.build_transition_tables()
+
+        # under the 'restart' crash policy a crash sends the car to a
+        # random starting point; its value is the mean over the start line,
+        # so every crash has the same backup ('crash_backup')
+        restarts = None
+        if self.car.crash_type == 'restart':
+            restarts = env.crashed & ~env.finished
+            is_start = np.zeros(env.n_states, dtype = bool)
+            is_start[env.start_states] = True
+            crashes = restarts.any(axis = 1)
+            noop_crashes = restarts[:, noop_idx]
+            crash_states = np.flatnonzero(crashes)
+            noop_crash_states = np.flatnonzero(noop_crashes)
+
+        if self.pred_pairs is None:
+            self.build_predecessors(restarts)
+
+        # the q-values of a state are p_transition times the backup of each
+        # action plus (1 - p_transition) times that of its no-op, so its
+        # largest q-value follows from its largest backup and its no-op's.
+        # the backups of the crashes are not kept in 'backups' (nor in
+        # 'max_backups'), but taken from 'crash_backup'
+        def q_max(states):
+            best, noop = max_backups[states], backups[states, noop_idx]
+            if restarts is not None:
+                best = np.where(crashes[states], np.maximum(best, crash_backup), best)
+                noop = np.where(noop_crashes[states], crash_backup, noop)
+            return p * best + (1 - p) * noop
+
+        # a state whose no-op lands on itself has a no-op backup of
+        # reward + discount * V in its own value V; V = q_max solves to the
+        # larger of the value of going on with its best other action and
+        # that of never leaving
+        self_loops = env.next_state[:, noop_idx] == np.arange(env.n_states)
+        self_loops &= ~env.finished[:, noop_idx]
+        if restarts is not None:
+            self_loops &= ~restarts[:, noop_idx]
+        other_actions = np.arange(env.n_actions) != noop_idx
+
+        # initialize the tables from one backup of the initial state
+        # values; the states it leaves a residual above 'theta' seed the
+        # queue. like a value iteration sweep, it counts as one sweep
+        self.v_table = self.init_v_table()
+        backups = self.action_backups(slice(None), restarts)
+        max_backups = backups.max(axis = 1)
+        if restarts is not None:
+            crash_backup = env.reward + self.r_discount * self.v_table[env.start_states].mean()
+            max_backups = np.where(restarts, -np.inf, backups).max(axis = 1)
+
+        # priority queue: buckets of tentative values (see 'queue_states'),
+        # each a list of arrays of state ids, spanning the initial value up
+        # to zero. a state is (re)queued in the bucket of its value whenever
+        # that is above the one it is queued in ('queued_bucket', -1 if
+        # none); the entries it leaves behind are skipped. every batch is
+        # the top bucket, so a batch costs in the states it updates and
+        # touches, never in the number of states
+        n_buckets = int(np.ceil(1 / ((1 - self.r_discount) * self.bucket_width))) + 1
+        buckets = [[] for _ in range(n_buckets)]
+        queued_bucket = np.full(env.n_states, -1, dtype = np.int64)
+        stamps = np.empty(env.n_states, dtype = np.int64)
+
+        residuals = q_max(slice(None)) - self.v_table
+        queued = np.flatnonzero(residuals > self.theta)
+        self.queue_states(queued, q_max(queued), buckets, queued_bucket)
+
+        # 'training_results' holds the largest value change of every
+        # sweep's worth of updates ('n_states' of them), as value
+        # iteration holds that of every sweep
+        self.training_results = {0 : residuals.max()}
+        sweep_delta = 0.0
+
+        max_updates = self.max_itr * env.n_states
+        self.n_backups = env.n_states
+
+        while self.n_backups < max_updates:
+
+            # take the live entries of the top bucket
+            top = next((b for b in reversed(range(n_buckets)) if buckets[b]), None)
+            if top is None:
+                break
+
+            states = np.concatenate(buckets[top])
+            buckets[top] = []
+            states = self.first_occurrences(states[queued_bucket[states] == top], stamps)
+            if len(states) == 0:
+                continue
+
+            queued_bucket[states] = -1
+
+            # update the batch to its largest q-values
+            v_old = self.v_table[states]
+            v_new = q_max(states)
+
+            loops = self_loops[states]
+            if loops.any():
+                go_on = backups[states[loops]]
+                if restarts is not None:
+                    go_on = np.where(restarts[states[loops]], crash_backup, go_on)
+                go_on = go_on[:, other_actions].max(axis = 1)
+                v_new[loops] = np.maximum(
+                    (p * go_on + (1 - p) * env.reward) / (1 - (1 - p) * self.r_discount),
+                    env.reward / (1 - self.r_discount))
+
+            deltas = v_new - v_old
+            self.v_table[states] = v_new
+            self.n_backups += len(states)
+
+            # carry the changes to the backups of the predecessor pairs
+            pairs, counts = self.gather(states)
+            pair_deltas = self.r_discount * np.repeat(deltas, counts)
+
+            # the backups only rise, so their largest follows without
+            # recomputing any row; the q_max of a predecessor only moves
+            # with its no-op backup or its largest one
+            backups.ravel()[pairs] += pair_deltas
+            pair_backups = backups.ravel()[pairs]
+            pred_states = pairs // env.n_actions
+            np.maximum.at(max_backups, pred_states, pair_backups)
+            moved = (pairs % env.n_actions == noop_idx) | \
+                    (pair_backups == max_backups[pred_states])
+            touched = [states, pred_states[moved]]
+
+            # the start line mean moves the backup of every crash, and so the
+            # q_max of the states whose no-op crashes or whose best move is a
+            # crash
+            if restarts is not None and is_start[states].any():
+                crash_backup += self.r_discount * deltas[is_start[states]].sum() / len(env.start_states)
+                touched += [noop_crash_states,
+                            crash_states[crash_backup > max_backups[crash_states]]]
+
+            # requeue the touched states whose residual now exceeds 'theta'
+            touched = self.first_occurrences(np.concatenate(touched), stamps)
+            values = q_max(touched)
+            requeue = values - self.v_table[touched] > self.theta
+            self.queue_states(touched[requeue], values[requeue], buckets, queued_bucket)
+
+            sweep_delta = max(sweep_delta, np.abs(deltas).max())
+            if self.n_backups >= (len(self.training_results) + 1) * env.n_states:
+                self.training_results[len(self.training_results)] = sweep_delta
+                sweep_delta = 0.0
+
+        # the last (partial) sweep's worth of updates
+        if self.n_backups > len(self.training_results) * env.n_states:
+            self.training_results[len(self.training_results)] = sweep_delta
+
+        if restarts is not None:
+            backups[restarts] = crash_backup
+        self.q_table = p * backups + (1 - p) * backups[:, noop_idx, None]
+        self.p_table = self.q_table.argmax(axis = 1)
+
+        if profiler.enabled:
+            profiler.count('backups', self.n_backups)
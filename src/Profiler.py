@@ -0,0 +1,97 @@
+# -*- coding: utf-8 -*-
+"""
+contains the 'Profiler' class and the shared 'profiler' instance used to
+instrument the hot paths of the simulator and learners. instrumentation
+is opt-in: timers are installed by wrapping the registered methods only
+while the profiler is enabled, and counters sit behind a single
+'profiler.enabled' check
+
+@name:          Profiler.py
+@author:        J. Tyler Leake
+@last update:   08-19-2024
+"""
+
+import time
+from collections import defaultdict
+from functools import wraps
+
+
+
+class Profiler:
+
+    def __init__(self):
+
+        self.enabled = False
+
+        # event counts (steps, crashes, finishes, explore/exploit picks)
+        # and cumulative seconds (inclusive) per timed function
+        self.counters = defaultdict(int)
+        self.timers = defaultdict(float)
+
+        # (class, method name, original method) of every timed method
+        self.registry = []
+
+    def register(self, cls, *method_names):
+        '''
+        registers methods of a class to be timed while enabled; the timer
+        of each is named '<class>.<method>'
+        '''
+        for name in method_names:
+            self.registry.append((cls, name, getattr(cls, name)))
+
+    def enable(self):
+        '''
+        starts counting and wraps every registered method in a timer
+        '''
+        if self.enabled:
+            return
+
+        for cls, name, method in self.registry:
+            setattr(cls, name, self.timed(f'{cls.__name__}.{name}', method))
+        self.enabled = True
+
+    def disable(self):
+        '''
+        stops counting and restores the original (untimed) methods
+        '''
+        for cls, name, method in self.registry:
+            setattr(cls, name, method)
+        self.enabled = False
+
+    def reset(self):
+        self.counters.clear()
+        self.timers.clear()
+
+    def timed(self, timer_name, func):
+        '''
+        returns 'func' wrapped to add its run time to the named timer
+        '''
+        timers = self.timers
+
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                timers[timer_name] += time.perf_counter() - start
+
+        return wrapper
+
+    def count(self, counter_name, n = 1):
+        self.counters[counter_name] += n
+
+    def add_time(self, timer_name, seconds):
+        self.timers[timer_name] += seconds
+
+    def report(self):
+        '''
+        returns a snapshot of the counters and timers as plain dicts
+        '''
+        return {'counters' : dict(self.counters),
+                'timers'   : dict(self.timers)}
+
+
+
+# shared instance used by every module
+profiler = Profiler()
@@ -1,172 +1,267 @@
-# -*- coding: utf-8 -*-
-"""
-contains implementation of the Q-Learning algorithm for the 
-racetrack problem as a class. 
-
-@name:          QLearning.py
-@author:        J. Tyler Leake
-@last update:   08-19-2024
-"""
-
-import numpy as np
-from Racetrack import *
-from Car import *
-from utils import *
-
-
-
-class QLearning:
-    
-    def __init__(self, Car, r_learning, r_discount, r_decay, p_explore, 
-                 episodes = 10, max_itr = 1000):
-
-        self.car = Car  # agent; contains the racetrack env.
-        self.q_table = None  # action-value function table
-        
-        # model hyperparameters
-        self.r_learning = r_learning
-        self.r_discount = r_discount
-        self.r_decay = r_decay
-        self.p_explore = p_explore
-        self.episodes = episodes
-        self.max_itr = max_itr
-        
-        # results
-        self.training_results = {}
-        
-    def train(self):
-        '''
-        implementation of off-policy Q-learning algorithm using an
-        epsilon-greedy explore vs. exploit strategy. 
-        
-        return: none; self.q_table updated directly
-        '''
-        # initialize action-value function (Q)
-        self.q_table = init_q_table(self.car.env) 
-        
-        for episode in range(self.episodes): 
-            
-            self.car.restart_env() # restart the agent at starting line
-            
-            Y_cord = self.car.X_cord_cur # retrieve agent's state vals
-            X_cord = self.car.Y_cord_cur
-            X_velo = self.car.X_velo
-            Y_velo = self.car.Y_velo
-            
-            # for each episode, iterate until either the agent 
-            # reaches the finish line or 'max_itr' is hit
-            
-            ep_itr = 0
-            done = False
-
-            while not done:
-                
-                # retrieve the q-values for the current state
-                q_vals = self.q_table[X_cord, Y_cord, X_velo, Y_velo]
-                
-                # action selection/transition probability: perform random 
-                # experiment and either a) do nothing or b) select action
-                
-                rand_sample = np.random.uniform(0, 1)
-                
-                # action: do nothing
-                if rand_sample > self.car.env.p_transition: 
-                    action = (0, 0)
-                    action_idx = self.car.env.actions.index(action)
-                    q_val = self.q_table[X_cord, Y_cord, X_velo, Y_velo, action_idx]
-                
-                # action: apply explore vs. exploit strategy
-                if rand_sample <= self.car.env.p_transition:
-                    action, action_idx, q_val = epsilon_greedy(self.car, \
-                                                          q_vals, self.p_explore)
-                
-                self.car.update_state(action) # perform action
-                
-                # check if car has finished. if true, then the episode 
-                # has completed. else update the q-table
-                
-                if self.car.is_finished: 
-                    done = True 
-                    
-                if not self.car.is_finished:
-                    
-                    # retrieve the new state values of the car
-                    X_cord = self.car.X_cord_cur
-                    Y_cord = self.car.Y_cord_cur
-                    X_velo = self.car.X_velo
-                    Y_velo = self.car.Y_velo
-                    
-                    # retrieve the q-values of the next state; get argmax
-                    q_vals_prime = self.q_table[X_cord, Y_cord, X_velo, Y_velo]
-                    q_prime_max = np.max(q_vals_prime)
-                    
-                    # compute the new q-value and update the q-table
-                    disc_reward = self.r_discount * q_prime_max
-                    q_val_update = (self.car.env.reward + disc_reward - q_val)
-                    q_val_update *= self.r_learning
-                    q_vals[action_idx] = q_val_update
-                
-                # innner loop stopping criterion
-                ep_itr += 1
-                if ep_itr == self.max_itr: done = True
-            
-            # decay: gradually decrease the exploration probability 
-            # and the learning rate during each iteration
-            
-            self.p_explore *= self.r_decay
-            
-            if self.r_learning > 0.01:
-                self.r_learning *= self.r_decay
-            
-            # finally: update the running performance table
-            self.training_results[episode] = ep_itr
-
-            
-    def test(self):
-        '''
-        testing simulator for the algorithm. executes the learned policy from
-        training on a fresh raceterack environment. 
-        '''
-        self.car.restart_env() # reset the car's state; place at starting line
-        
-        # iterate until either the agent has reached the finish 
-        # line or the 'max_itr' is hit
-        
-        test_itr = 0
-        done = False
-        
-        while not done:
-            
-            # retrive the current state of the car
-            X_cord = self.car.X_cord_cur
-            Y_cord = self.car.Y_cord_cur
-            X_velo = self.car.X_velo
-            Y_velo = self.car.Y_velo
-            
-            s = (X_cord, Y_cord, X_velo, Y_velo)
-            
-            # retieve the q-values for the current state
-            q_vals = self.q_table[X_cord,Y_cord, X_velo, Y_velo]
-            
-            # action selection: apply explore vs. exploit strategy
-            action, action_idx, q_val = epsilon_greedy(self.car, q_vals, self.p_explore)
-            
-            self.car.update_state(action) # perform the action
-            
-            # retrive the next state of the car
-            X_cord = self.car.X_cord_cur
-            Y_cord = self.car.Y_cord_cur
-            X_velo = self.car.X_velo
-            Y_velo = self.car.Y_velo
-            
-            s_prime = (X_cord, Y_cord, X_velo, Y_velo)
-            
-            print(s, action, s_prime)
-            
-            # stopping criteria: check if car has finished or if the 
-            # max_itr has been hit; if true, terminate
-            test_itr += 1
-            
-            if self.car.is_finished: done = True
-            if test_itr >= 500: done = True
-            
+# -*- coding: utf-8 -*-
+"""
+contains implementation of the Q-Learning algorithm for the 
+racetrack problem as a class. 
+
+@name:          QLearning.py
+@author:        J. Tyler Leake
+@last update:   08-19-2024
+"""
+
+import numpy as np
+import random
+import time
+from Racetrack import *
+from Car import *
+from utils import *
+from Checkpoint import Checkpoint
+from Profiler import profiler
+
+
+
+class QLearning:
+    
+    def __init__(self, Car, r_learning, r_discount, r_decay, p_explore, 
+                 episodes = 10, max_itr = 1000, 
+                 q_init = 'random', q_dtype = np.float64, q_sparse = False, 
+                 metrics = None, checkpoint_dir = None, checkpoint_every = 100):
+
+        self.car = Car  # agent; contains the racetrack env.
+        self.q_table = None  # action-value function table
+        self.q_init = q_init  # q_table initialization strategy and dtype
+        self.q_dtype = q_dtype
+        
+        # with 'q_sparse', the q_table is a 'SparseQTable' that allocates 
+        # the action values of a state on its first visit (for tracks too 
+        # large to hold densely); it cannot be memory-mapped
+        self.q_sparse = q_sparse
+        if q_sparse and checkpoint_dir is not None: 
+            raise ValueError('a sparse q_table cannot be checkpointed')
+        
+        # model hyperparameters
+        self.r_learning = r_learning
+        self.r_discount = r_discount
+        self.r_decay = r_decay
+        self.p_explore = p_explore
+        self.episodes = episodes
+        self.max_itr = max_itr
+        
+        # results; with a 'MetricsLog' as 'metrics', episode records are 
+        # streamed to disk instead of kept in 'training_results'
+        self.training_results = {}
+        self.test_results = {}
+        self.metrics = metrics
+        self.episode_count = 0
+        
+        # with a 'checkpoint_dir', the q_table is a memory-mapped file that 
+        # is checkpointed every 'checkpoint_every' episodes
+        self.checkpoint = None if checkpoint_dir is None else Checkpoint(checkpoint_dir)
+        self.checkpoint_every = checkpoint_every
+        
+    def train(self, resume = False):
+        '''
+        implementation of off-policy Q-learning algorithm using an
+        epsilon-greedy explore vs. exploit strategy. with 'resume', 
+        training continues for another 'episodes' episodes from the 
+        current q_table, episode count and decayed rates (restored from 
+        the last checkpoint if the learner has no q_table yet)
+        
+        return: none; self.q_table updated directly
+        '''
+        # the car steps through the environment's transition tables; a 
+        # sparse q_table is meant for tracks too large for them, so a 
+        # sparse learner simulates every step instead (see 'Car.step')
+        if self.car.env.next_state is None and not self.q_sparse:
+            self.car.env.build_transition_tables()
+        
+        if resume and self.q_table is None and self.checkpoint is not None:
+            self.load_checkpoint()
+        
+        # initialize action-value function (Q)
+        if not resume or self.q_table is None:
+            self.q_table = init_q_table(self.car.env, self.q_init, self.q_dtype, 
+                                        sparse = self.q_sparse)
+            if self.checkpoint is not None: 
+                self.q_table = self.checkpoint.create_table('q_table', self.q_table)
+            self.training_results = {}
+            self.episode_count = 0
+            if self.metrics is not None: 
+                self.metrics.reset()
+        
+        first_episode = self.episode_count
+        
+        for episode in range(first_episode, first_episode + self.episodes): 
+            
+            self.car.restart_env() # restart the agent at starting line
+            state = self.car.state # retrieve agent's packed state
+            ep_start = time.perf_counter()
+            ep_return = 0
+            
+            # for each episode, iterate until either the agent 
+            # reaches the finish line or 'max_itr' is hit
+            
+            ep_itr = 0
+            done = False
+
+            while not done:
+                
+                action_idx = self.select_action(state)
+                state_new, reward, finished = self.car.step(action_idx)
+                ep_return += reward
+                
+                # compute the new q-value and update the q-table
+                if profiler.enabled: update_start = time.perf_counter()
+                self.update(state, action_idx, reward, state_new, finished)
+                if profiler.enabled: 
+                    profiler.add_time('QLearning.q_update', time.perf_counter() - update_start)
+                
+                state = state_new
+                
+                # innner loop stopping criterion
+                ep_itr += 1
+                if finished or ep_itr == self.max_itr: done = True
+            
+            # update the running performance table, or stream the 
+            # episode's record to the metrics log
+            if self.metrics is None:
+                self.training_results[episode] = ep_itr
+            else:
+                self.metrics.append(episode, ep_itr, ep_return, self.p_explore, 
+                                    self.r_learning, time.perf_counter() - ep_start)
+            self.episode_count += 1
+            
+            if profiler.enabled: 
+                profiler.count('episodes')
+                profiler.add_time('QLearning.episode', time.perf_counter() - ep_start)
+            
+            # finally: gradually decrease the exploration probability 
+            # and the learning rate during each iteration
+            
+            self.p_explore *= self.r_decay
+            
+            if self.r_learning > 0.01:
+                self.r_learning *= self.r_decay
+            
+            if self.checkpoint is not None and \
+               self.episode_count % self.checkpoint_every == 0:
+                self.save_checkpoint()
+        
+        if self.metrics is not None: 
+            self.metrics.flush()
+        if self.checkpoint is not None: 
+            self.save_checkpoint()
+            
+            
+    def update(self, state, action_idx, reward, state_new, finished):
+        '''
+        one-step q-learning update of the q-value of a state/action pair 
+        from an observed transition; the finish line is terminal, so it 
+        has no next state value
+        '''
+        q_val = self.q_table[state, action_idx]
+        q_target = reward
+        if not finished:
+            q_target += self.r_discount * self.q_table[state_new].max()
+        self.q_table[state, action_idx] = q_val + self.r_learning * (q_target - q_val)
+    
+    def save_checkpoint(self):
+        '''
+        flushes the memory-mapped q_table and saves the episode counter 
+        and decayed rates alongside it; the metrics log is flushed first 
+        so that it covers every checkpointed episode, and its number of 
+        chunks is saved with them
+        '''
+        metric_chunks = None
+        if self.metrics is not None: 
+            self.metrics.flush()
+            metric_chunks = self.metrics.n_chunks
+        self.checkpoint.save({'episode_count' : self.episode_count, 
+                              'p_explore'     : self.p_explore, 
+                              'r_learning'    : self.r_learning, 
+                              'metric_chunks' : metric_chunks})
+    
+    def load_checkpoint(self):
+        '''
+        restores the q_table, episode counter and decayed rates from the 
+        last checkpoint, if there is one; the episodes logged to the 
+        metrics log after the checkpoint are dropped, as they are replayed
+        '''
+        state = self.checkpoint.load()
+        if state is None: 
+            return
+        
+        self.q_table = self.checkpoint.restore_table('q_table')
+        self.episode_count = state['episode_count']
+        self.p_explore = state['p_explore']
+        self.r_learning = state['r_learning']
+        if self.metrics is not None and state['metric_chunks'] is not None: 
+            self.metrics.truncate(state['metric_chunks'])
+    
+    def select_action(self, state):
+        '''
+        action selection/transition probability: perform random experiment 
+        and either a) do nothing or b) apply the explore vs. exploit 
+        strategy; returns the index of the action applied
+        '''
+        env = self.car.env
+        
+        if random.random() > env.p_transition: 
+            return env.action_idx[(0, 0)]
+        
+        return epsilon_greedy_idx(self.q_table[state], self.p_explore)
+            
+    def test(self):
+        '''
+        testing simulator for the algorithm. executes the learned policy from
+        training on a fresh raceterack environment. 
+        '''
+        self.car.restart_env() # reset the car's state; place at starting line
+        
+        # iterate until either the agent has reached the finish 
+        # line or the 'max_itr' is hit
+        
+        test_itr = 0
+        done = False
+        
+        while not done:
+            
+            # retrive the current state of the car
+            X_cord = self.car.X_cord_cur
+            Y_cord = self.car.Y_cord_cur
+            X_velo = self.car.X_velo
+            Y_velo = self.car.Y_velo
+            
+            s = (X_cord, Y_cord, X_velo, Y_velo)
+            
+            # retieve the q-values for the current state
+            state = self.car.env.encode_state(X_cord, Y_cord, X_velo, Y_velo)
+            q_vals = self.q_table[state]
+            
+            # action selection: apply explore vs. exploit strategy
+            action, action_idx, q_val = epsilon_greedy(self.car, q_vals, self.p_explore)
+            
+            self.car.update_state(action) # perform the action
+            
+            # retrive the next state of the car
+            X_cord = self.car.X_cord_cur
+            Y_cord = self.car.Y_cord_cur
+            X_velo = self.car.X_velo
+            Y_velo = self.car.Y_velo
+            
+            s_prime = (X_cord, Y_cord, X_velo, Y_velo)
+            
+            print(s, action, s_prime)
+            
+            # stopping criteria: check if car has finished or if the 
+            # max_itr has been hit; if true, terminate
+            test_itr += 1
+            
+            if self.car.is_finished: done = True
+            if test_itr >= 500: done = True
+        
+        # record the number of steps taken in this test run
+        self.test_results[len(self.test_results)] = test_itr
+
+
+# methods timed while the profiler is enabled
+profiler.register(QLearning, 'select_action')
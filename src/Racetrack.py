@@ -1,121 +1,468 @@
-# -*- coding: utf-8 -*-
-"""
-contains the 'Racetrack' class representing the environment of the 
-racetrack problem. 
-
-@name:          Racetrack.py
-@author:        J. Tyler Leake
-@last update:   08-19-2024
-"""
-
-import numpy as np
-import random
-from itertools import combinations
-from math import sqrt
-
-
-
-class Racetrack(): 
-    
-    def __init__(self, 
-                 env_path, 
-                 p_transition= 0.80, 
-                 reward = -1, 
-                 accl_range = (-1, 1), 
-                 X_velo_range = (-5, 5), 
-                 Y_velo_range = (-5, 5)):
-        
-        # environment dimensions (x,y coordinates, velocities)
-        self.X_cord_dim = None
-        self.Y_cord_dim = None
-        self.X_velo_dim = (X_velo_range[0], X_velo_range[1])
-        self.Y_velo_dim = (Y_velo_range[0], Y_velo_range[1])
-        
-        # map representation of the track and coordinates for the 
-        # start, finish, wall and track spaces
-        self.map_rep = self.load_env(env_path)
-        self.start_cords = self.get_coordinates('S')
-        self.finish_cords = self.get_coordinates('F')
-        self.track_cords = self.get_coordinates('.')
-        self.wall_cords = self.get_coordinates('#')
-        
-        # velocity and acceleration attr.
-        self.actions = self.get_actions(accl_range)
-        
-        # reward and transition function attributes
-        self.reward = reward
-        self.p_transition = p_transition
-        
-        # finish line boundary and orientation helpers
-        self.fbound1 = None
-        self.fbound2 = None
-        self.is_vert_finish = None
-        
-        self.get_finish_orientation()
-        
-    def load_env(self, env_path):
-        '''
-        loads the dataset in from the filepath and converts to np
-        array; stores the x,y coordinate dimensions from file line 1
-        '''
-        with open(env_path) as env_data: lines = env_data.readlines()
-        lines = [line.strip() for line in lines]
-        env_dims = lines.pop(0)
-        env_dims = env_dims.split(',')
-        self.X_cord_dim, self.Y_cord_dim = int(env_dims[0]), int(env_dims[1])
-        env_arr = [list(line) for line in lines]
-        return np.array(env_arr)
-
-    def get_coordinates(self, char):
-        '''
-        returns the coordinates in the array where the 'char' arg 
-        is found; used to find start/finish coordinates
-        '''
-        coordinates = np.where(self.map_rep == char)
-        X_cords, Y_cords = coordinates[0], coordinates[1]
-        coordinates = [(X_cords[i], Y_cords[i]) for i in range(len(X_cords))]
-        return coordinates
-    
-    def get_actions(self, accl_range):
-        '''
-        returns the set of possbile actions for the agent in the 
-        environment from the acceleration range provided as a list 
-        '''
-        accl_range = np.arange(accl_range[0], accl_range[1] + 1)
-        actions = [(X_accl, Y_accl) for Y_accl in accl_range for X_accl in accl_range]
-        return actions
-    
-    def get_rand_start(self):
-        '''
-        selects one of the starting points in the env. randomly
-        '''
-        return random.choice(self.start_cords)
-    
-    def get_finish_orientation(self):
-        '''
-        determines whether the finish line is vertically or 
-        horizontally oriented
-        '''
-        
-        # compute distance between each 2-combination of coordinates 
-        # in the finish line and determine farthest pair
-        max_distance = 0
-        farthest_pairs = None
-        
-        for fin1, fin2 in combinations(self.finish_cords, 2):
-
-            distance = sqrt((fin1[0] - fin2[0])**2 + (fin1[1] - fin2[1])**2)
-            
-            if distance > max_distance: 
-                farthest_pairs = (fin1, fin2)
-                max_distance = distance
-        
-        self.fbound1, self.fbound2 = farthest_pairs[0], farthest_pairs[1]
-        
-        # if the farthest coordinates have same x-axis value, the line 
-        # is horizontal, else it is vertical
-        self.is_vert_finish = True
-        
-        if farthest_pairs[0][0] == farthest_pairs[1][0]: 
-            self.is_vert_finish  = False   
-
+# -*- coding: utf-8 -*-
+"""
+contains the 'Racetrack' class representing the environment of the 
+racetrack problem. 
+
+@name:          Racetrack.py
+@author:        J. Tyler Leake
+@last update:   08-19-2024
+"""
+
+import numpy as np
+import hashlib
+import os
+import random
+import scipy.sparse as sp
+from scipy.ndimage import distance_transform_edt
+from scipy.sparse.csgraph import dijkstra
+from StateIndex import StateIndex
+
+
+# cell type codes of the occupancy grid; codes up to WALL are a crash
+OFF_MAP, WALL, TRACK, START, FINISH = 0, 1, 2, 3, 4
+
+# map character of each cell type code; off-map cells never occur in a file
+CELL_CHARS = np.array([' ', '#', '.', 'S', 'F'])
+
+# layout version of the track cache; part of the cache key
+CACHE_VERSION = 1
+
+
+class Racetrack(): 
+    
+    def __init__(self, 
+                 env_path, 
+                 p_transition= 0.80, 
+                 reward = -1, 
+                 accl_range = (-1, 1), 
+                 X_velo_range = (-5, 5), 
+                 Y_velo_range = (-5, 5), 
+                 precompute_transitions = True, 
+                 cache_dir = None):
+        
+        # environment dimensions (x,y coordinates, velocities)
+        self.X_cord_dim = None
+        self.Y_cord_dim = None
+        self.X_velo_dim = (X_velo_range[0], X_velo_range[1])
+        self.Y_velo_dim = (Y_velo_range[0], Y_velo_range[1])
+        self.n_X_velo = self.X_velo_dim[1] - self.X_velo_dim[0] + 1
+        self.n_Y_velo = self.Y_velo_dim[1] - self.Y_velo_dim[0] + 1
+        
+        # occupancy grid padding: the max distance a car can move in one step
+        self.grid_pad = int(max(1, *np.abs(self.X_velo_dim), *np.abs(self.Y_velo_dim)))
+        
+        # finish line boundary and orientation helpers
+        self.fbound1 = None
+        self.fbound2 = None
+        self.is_vert_finish = None
+        
+        # with a 'cache_dir', the parsed track and its derived tables are 
+        # kept in a .npz keyed by the content of the track file, so later 
+        # constructions of the same track skip parsing and table building
+        self.cache_path = None
+        if cache_dir is not None: 
+            self.cache_path = self.get_cache_path(env_path, cache_dir, accl_range)
+        cached = self.cache_path is not None and os.path.exists(self.cache_path)
+        
+        if cached: 
+            self.load_track_cache()
+        else: 
+            # map representation of the track and coordinates for the 
+            # start, finish, wall and track spaces
+            self.map_rep = self.load_env(env_path)
+            self.start_cords = self.get_coordinates('S')
+            self.finish_cords = self.get_coordinates('F')
+            self.track_cords = self.get_coordinates('.')
+            self.wall_cords = self.get_coordinates('#')
+            
+            # occupancy grid of cell type codes, padded with off-map cells 
+            # by 'grid_pad'
+            self.occupancy = self.get_occupancy_grid()
+            
+            # nearest track/start coordinate to every cell of the padded 
+            # grid; where the 'nearest' crash policy relocates a crashed car
+            self.relief_map = self.get_relief_map()
+            
+            self.get_finish_orientation()
+        
+        # velocity and acceleration attr.
+        self.actions = self.get_actions(accl_range)
+        self.action_idx = {action: idx for idx, action in enumerate(self.actions)}
+        self.n_actions = len(self.actions)
+        
+        # contiguous ids over the drivable states; keys every table
+        self.state_index = StateIndex(self)
+        self.n_states = self.state_index.n_states
+        start_cords = np.array(self.start_cords)
+        self.start_states = self.encode_state(start_cords[:, 0], start_cords[:, 1], 0, 0)
+        
+        # reward and transition function attributes
+        self.reward = reward
+        self.p_transition = p_transition
+        
+        # transition tables: next state index and finished/crashed flags 
+        # for every (state, action) pair; see 'build_transition_tables'
+        self.next_state = None
+        self.finished = None
+        self.crashed = None
+        
+        if precompute_transitions: 
+            self.build_transition_tables()
+        elif self.cache_path is not None and not cached: 
+            self.save_cache()
+        
+    def load_env(self, env_path):
+        '''
+        loads the dataset in from the filepath and converts to np
+        array; stores the x,y coordinate dimensions from file line 1
+        '''
+        with open(env_path) as env_data: lines = env_data.readlines()
+        lines = [line.strip() for line in lines]
+        env_dims = lines.pop(0)
+        env_dims = env_dims.split(',')
+        self.X_cord_dim, self.Y_cord_dim = int(env_dims[0]), int(env_dims[1])
+        env_arr = [list(line) for line in lines]
+        return np.array(env_arr)
+
+    def get_coordinates(self, char):
+        '''
+        returns the coordinates in the array where the 'char' arg 
+        is found; used to find start/finish coordinates
+        '''
+        coordinates = np.where(self.map_rep == char)
+        X_cords, Y_cords = coordinates[0], coordinates[1]
+        coordinates = [(X_cords[i], Y_cords[i]) for i in range(len(X_cords))]
+        return coordinates
+    
+    def get_occupancy_grid(self):
+        '''
+        returns the map as a uint8 grid of cell type codes padded on 
+        every side by 'grid_pad' off-map cells; the cell at coordinate 
+        (x, y) sits at (x + grid_pad, y + grid_pad)
+        '''
+        pad = self.grid_pad
+        occupancy = np.full((self.X_cord_dim + 2 * pad, self.Y_cord_dim + 2 * pad), 
+                            OFF_MAP, dtype = np.uint8)
+        
+        inner = occupancy[pad:pad + self.X_cord_dim, pad:pad + self.Y_cord_dim]
+        for char, code in (('#', WALL), ('.', TRACK), ('S', START), ('F', FINISH)):
+            inner[self.map_rep == char] = code
+            
+        return occupancy
+    
+    def get_relief_map(self):
+        '''
+        returns an int32 array of shape (*occupancy.shape, 2) holding the 
+        nearest track/start coordinate (unpadded) to every cell of the 
+        padded occupancy grid, via a euclidean distance transform
+        '''
+        is_relief = (self.occupancy == TRACK) | (self.occupancy == START)
+        
+        # the transform gives, for every non-zero cell, the index of the 
+        # nearest zero cell; relief cells are therefore marked zero
+        nearest = distance_transform_edt(~is_relief, return_distances = False, 
+                                         return_indices = True)
+        relief_map = np.stack(nearest, axis = -1).astype(np.int32) - self.grid_pad
+        
+        return relief_map
+    
+    def get_finish_distance(self):
+        '''
+        returns the breadth-first distance (in 8-connected moves over 
+        drivable cells) from every drivable cell to the nearest finish 
+        cell, indexed by cell id (see 'StateIndex'); inf where unreachable
+        '''
+        index = self.state_index
+        
+        # link every drivable cell to its drivable neighbors; the index is 
+        # padded with walls so that the shifted views stay in bounds
+        padded = np.pad(index.cell_index, 1, constant_values = -1)
+        cells = padded[1:-1, 1:-1]
+        
+        links = []
+        for dX, dY in ((0, 1), (1, 0), (1, 1), (1, -1)):
+            neighbors = padded[1 + dX:1 + dX + self.X_cord_dim, 1 + dY:1 + dY + self.Y_cord_dim]
+            linked = (cells >= 0) & (neighbors >= 0)
+            links.append((cells[linked], neighbors[linked]))
+            
+        rows = np.concatenate([link[0] for link in links])
+        cols = np.concatenate([link[1] for link in links])
+        graph = sp.csr_matrix((np.ones(len(rows)), (rows, cols)), 
+                              shape = (index.n_cells, index.n_cells))
+        
+        finish_cords = np.array(self.finish_cords)
+        finish_cells = index.cell_index[finish_cords[:, 0], finish_cords[:, 1]]
+        
+        return dijkstra(graph, directed = False, indices = finish_cells, 
+                        unweighted = True, min_only = True)
+    
+    def get_actions(self, accl_range):
+        '''
+        returns the set of possbile actions for the agent in the 
+        environment from the acceleration range provided as a list 
+        '''
+        accl_range = np.arange(accl_range[0], accl_range[1] + 1)
+        actions = [(X_accl, Y_accl) for Y_accl in accl_range for X_accl in accl_range]
+        return actions
+    
+    def get_rand_start(self):
+        '''
+        selects one of the starting points in the env. randomly
+        '''
+        return random.choice(self.start_cords)
+    
+    def get_finish_orientation(self):
+        '''
+        determines whether the finish line is vertically or 
+        horizontally oriented
+        '''
+        
+        # compute distance between each 2-combination of coordinates 
+        # in the finish line and determine farthest pair; only pairs above 
+        # the diagonal are kept, so the first farthest pair in row-major 
+        # order is the first in combination order
+        finish_cords = np.array(self.finish_cords)
+        deltas = finish_cords[:, None, :] - finish_cords[None, :, :]
+        distances = np.sqrt((deltas**2).sum(axis = -1))
+        distances[np.tril_indices(len(finish_cords))] = 0
+        
+        fin1, fin2 = np.unravel_index(distances.argmax(), distances.shape)
+        farthest_pairs = (self.finish_cords[fin1], self.finish_cords[fin2])
+        
+        self.fbound1, self.fbound2 = farthest_pairs[0], farthest_pairs[1]
+        
+        # if the farthest coordinates have same x-axis value, the line 
+        # is horizontal, else it is vertical
+        self.is_vert_finish = True
+        
+        if farthest_pairs[0][0] == farthest_pairs[1][0]: 
+            self.is_vert_finish  = False
+    
+    def get_cache_path(self, env_path, cache_dir, accl_range):
+        '''
+        returns the track cache file of the track; keyed by a hash of the 
+        file content and of the settings the derived tables depend on
+        '''
+        key = hashlib.sha256()
+        with open(env_path, 'rb') as env_file: key.update(env_file.read())
+        key.update(repr((CACHE_VERSION, self.X_velo_dim, self.Y_velo_dim, 
+                         tuple(accl_range))).encode())
+        
+        name = os.path.splitext(os.path.basename(env_path))[0]
+        return os.path.join(cache_dir, f'{name}-{key.hexdigest()[:16]}.npz')
+    
+    def save_cache(self):
+        '''
+        writes the parsed track (and the transition tables, if built) to 
+        the track cache. the file is replaced atomically, so concurrent 
+        workers building the same track never read a partial cache
+        '''
+        cords = lambda cords: np.array(cords, dtype = np.int64).reshape(-1, 2)
+        arrays = {
+            'dims'           : np.array([self.X_cord_dim, self.Y_cord_dim]), 
+            'occupancy'      : self.occupancy, 
+            'relief_map'     : self.relief_map, 
+            'start_cords'    : cords(self.start_cords), 
+            'finish_cords'   : cords(self.finish_cords), 
+            'track_cords'    : cords(self.track_cords), 
+            'wall_cords'     : cords(self.wall_cords), 
+            'fbounds'        : cords([self.fbound1, self.fbound2]), 
+            'is_vert_finish' : np.array(self.is_vert_finish)}
+        
+        if self.next_state is not None: 
+            arrays.update(next_state = self.next_state, finished = self.finished, 
+                          crashed = self.crashed)
+        
+        os.makedirs(os.path.dirname(self.cache_path) or '.', exist_ok = True)
+        tmp_path = f'{self.cache_path}.{os.getpid()}.tmp'
+        with open(tmp_path, 'wb') as cache_file: 
+            np.savez(cache_file, **arrays)
+        os.replace(tmp_path, self.cache_path)
+    
+    def load_track_cache(self):
+        '''
+        restores the parsed track from the track cache; the transition 
+        tables are only read once needed (see 'load_table_cache')
+        '''
+        with np.load(self.cache_path) as cache:
+            self.X_cord_dim, self.Y_cord_dim = cache['dims'].tolist()
+            self.occupancy = cache['occupancy']
+            self.relief_map = cache['relief_map']
+            self.start_cords = [tuple(cord) for cord in cache['start_cords']]
+            self.finish_cords = [tuple(cord) for cord in cache['finish_cords']]
+            self.track_cords = [tuple(cord) for cord in cache['track_cords']]
+            self.wall_cords = [tuple(cord) for cord in cache['wall_cords']]
+            self.fbound1, self.fbound2 = [tuple(cord) for cord in cache['fbounds']]
+            self.is_vert_finish = bool(cache['is_vert_finish'])
+        
+        # the character map is recovered from the unpadded occupancy grid
+        pad = self.grid_pad
+        self.map_rep = CELL_CHARS[self.occupancy[pad:pad + self.X_cord_dim, 
+                                                 pad:pad + self.Y_cord_dim]]
+    
+    def load_table_cache(self):
+        '''
+        restores the transition tables from the track cache; returns 
+        false if they have not been cached yet
+        '''
+        if not os.path.exists(self.cache_path): 
+            return False
+        
+        with np.load(self.cache_path) as cache:
+            if 'next_state' not in cache.files: 
+                return False
+            self.next_state = cache['next_state']
+            self.finished = cache['finished']
+            self.crashed = cache['crashed']
+        
+        return True
+    
+    def encode_state(self, X_cord, Y_cord, X_velo, Y_velo):
+        '''
+        packs the coordinates and velocities of a drivable state into its 
+        integer id (see 'StateIndex'); accepts scalars or np arrays
+        '''
+        return self.state_index.encode(X_cord, Y_cord, X_velo, Y_velo)
+    
+    def decode_state(self, state):
+        '''
+        inverse of 'encode_state'; unpacks a state id (or np array of 
+        ids) into its x/y coordinates and x/y velocities
+        '''
+        return self.state_index.decode(state)
+    
+    def cell_type(self, X_cord, Y_cord):
+        '''
+        returns the occupancy grid code of the coordinates (scalars or 
+        np arrays); coordinates beyond the padding read as off-map
+        '''
+        X_pad = np.clip(np.asarray(X_cord) + self.grid_pad, 0, self.occupancy.shape[0] - 1)
+        Y_pad = np.clip(np.asarray(Y_cord) + self.grid_pad, 0, self.occupancy.shape[1] - 1)
+        return self.occupancy[X_pad, Y_pad]
+    
+    def is_crash(self, X_cord, Y_cord):
+        '''
+        determines if the coordinates (scalars or np arrays) are in a 
+        wall or off of the map
+        '''
+        return self.cell_type(X_cord, Y_cord) <= WALL
+    
+    def crossed_finish(self, X_cord_old, Y_cord_old, X_cord_new, Y_cord_new):
+        '''
+        vectorized form of 'Car.check_if_finished'. determines if moving 
+        from the old to the new coordinates crosses the finish line
+        '''
+        # distance to the finish line before and after the move is taken 
+        # along the axis the line is crossed on; the bounds check is 
+        # taken along the axis the line spans
+        axis = 1 if self.is_vert_finish else 0
+        span = 0 if self.is_vert_finish else 1
+        old_cords = (X_cord_old, Y_cord_old)
+        new_cords = (X_cord_new, Y_cord_new)
+        
+        dist_pre_act = self.fbound1[axis] - old_cords[axis]
+        dist_pst_act = self.fbound1[axis] - new_cords[axis]
+        crossed = (dist_pre_act * dist_pst_act) <= 0
+        
+        lo, hi = self.fbound1[span], self.fbound2[span]
+        within_fbounds = ((lo <= old_cords[span]) & (old_cords[span] <= hi)) | \
+                         ((lo <= new_cords[span]) & (new_cords[span] <= hi))
+        
+        return crossed & within_fbounds
+    
+    def nearest_relief(self, X_cord, Y_cord):
+        '''
+        returns the nearest track/start coordinates to each of the 
+        coordinates given (scalars or np arrays) from the relief map; used 
+        by the 'nearest' crash policy
+        '''
+        X_pad = np.clip(np.asarray(X_cord) + self.grid_pad, 0, self.relief_map.shape[0] - 1)
+        Y_pad = np.clip(np.asarray(Y_cord) + self.grid_pad, 0, self.relief_map.shape[1] - 1)
+        min_relief = self.relief_map[X_pad, Y_pad]
+        return min_relief[..., 0], min_relief[..., 1]
+    
+    def simulate(self, X_cord, Y_cord, X_velo, Y_velo, X_accl, Y_accl):
+        '''
+        vectorized transition kernel mirroring 'Car.update_state' on np 
+        arrays of states and accelerations.
+        
+        return: 
+        the landing x/y coordinates, the new x/y velocities and the 
+        finished/crashed flags; crashed cars are not relocated here
+        '''
+        # compute the new velocity; assert it does not exceed speed limits
+        X_velo_new = np.clip(X_velo + X_accl, self.X_velo_dim[0], self.X_velo_dim[1])
+        Y_velo_new = np.clip(Y_velo + Y_accl, self.Y_velo_dim[0], self.Y_velo_dim[1])
+        
+        X_cord_new = X_cord + X_velo_new
+        Y_cord_new = Y_cord + Y_velo_new
+        
+        finished = self.crossed_finish(X_cord, Y_cord, X_cord_new, Y_cord_new)
+        crashed = self.is_crash(X_cord_new, Y_cord_new)
+        
+        return X_cord_new, Y_cord_new, X_velo_new, Y_velo_new, finished, crashed
+    
+    def simulate_transition(self, state, action_idx):
+        '''
+        computes the outcome of taking an action in a state by simulating 
+        the move, as held in the transition tables (see 
+        'build_transition_tables'); works on np arrays of indices
+        
+        return: 
+        next state index, finished flag, crashed flag
+        '''
+        X_cord, Y_cord, X_velo, Y_velo = self.decode_state(np.asarray(state))
+        X_accl, Y_accl = np.array(self.actions)[action_idx].T
+        
+        X_new, Y_new, X_velo_new, Y_velo_new, finished, crashed = \
+            self.simulate(X_cord, Y_cord, X_velo, Y_velo, X_accl, Y_accl)
+        
+        # place crashed cars at the nearest track coordinate; reset speed
+        X_relief, Y_relief = self.nearest_relief(X_new, Y_new)
+        X_new, Y_new = np.where(crashed, X_relief, X_new), np.where(crashed, Y_relief, Y_new)
+        X_velo_new, Y_velo_new = np.where(crashed, 0, X_velo_new), np.where(crashed, 0, Y_velo_new)
+        
+        return self.encode_state(X_new, Y_new, X_velo_new, Y_velo_new), finished, crashed
+    
+    def build_transition_tables(self):
+        '''
+        precomputes the deterministic outcome of every action in every 
+        state of the environment. 'next_state' holds the state index the 
+        car lands in (crashes relocated under the 'nearest' policy); 
+        'finished' and 'crashed' flag the finish/crash events. a finish 
+        takes precedence over a crash for the callers of these tables. 
+        with a track cache, the tables are read from (or added to) it
+        '''
+        if self.cache_path is not None and self.load_table_cache(): 
+            return
+        
+        index_dtype = np.int32 if self.n_states < 2**31 else np.int64
+        states = np.arange(self.n_states, dtype = index_dtype)
+        
+        self.next_state = np.empty((self.n_states, self.n_actions), dtype = index_dtype)
+        self.finished = np.empty((self.n_states, self.n_actions), dtype = bool)
+        self.crashed = np.empty((self.n_states, self.n_actions), dtype = bool)
+        
+        for action_idx in range(self.n_actions):
+            
+            self.next_state[:, action_idx], self.finished[:, action_idx], \
+                self.crashed[:, action_idx] = self.simulate_transition(states, action_idx)
+        
+        if self.cache_path is not None: 
+            self.save_cache()
+    
+    def transition(self, state, action_idx):
+        '''
+        looks up the outcome of taking an action in a state from the 
+        transition tables; works on scalars or np arrays of indices. an 
+        env without tables simulates the move instead
+        
+        return: 
+        next state index, finished flag, crashed flag
+        '''
+        if self.next_state is None: 
+            return self.simulate_transition(state, action_idx)
+        
+        return (self.next_state[state, action_idx], 
+                self.finished[state, action_idx], 
+                self.crashed[state, action_idx])
@@ -0,0 +1,57 @@
+# -*- coding: utf-8 -*-
+"""
+contains implementation of the SARSA(lambda) algorithm for the racetrack
+problem as a class: SARSA whose temporal difference errors also update
+the recently visited state/action pairs, through eligibility traces
+
+@name:          SARSALambda.py
+@author:        J. Tyler Leake
+@last update:   08-19-2024
+"""
+
+import numpy as np
+from SARSA import SARSA
+from EligibilityTraces import EligibilityTraces
+
+
+
+class SARSALambda(SARSA):
+
+    def __init__(self, Car, r_learning, r_discount, r_decay, p_explore,
+                 episodes = 100, max_itr = 100, r_trace = 0.9, trace_cutoff = 0.01,
+                 q_init = 'random', q_dtype = np.float64, q_sparse = False,
+                 metrics = None, checkpoint_dir = None, checkpoint_every = 100):
+
+        # trace updates index the q_table with arrays of pair ids
+        if q_sparse:
+            raise ValueError('eligibility traces need a dense q_table')
+
+        super().__init__(Car, r_learning, r_discount, r_decay, p_explore,
+                         episodes, max_itr, q_init, q_dtype, q_sparse, metrics,
+                         checkpoint_dir, checkpoint_every)
+
+        # trace decay rate (lambda); traces below 'trace_cutoff' are
+        # dropped, which bounds the number of active traces
+        self.r_trace = r_trace
+        self.traces = EligibilityTraces(r_discount * r_trace, trace_cutoff)
+
+        # episode the active traces belong to
+        self.trace_episode = None
+
+    def update(self, state, action_idx, reward, state_new, action_idx_new, finished):
+        '''
+        SARSA(lambda) update from an observed transition: the temporal
+        difference error of the pair updates every pair with an active
+        trace; traces end with the episode
+        '''
+        if self.trace_episode != self.episode_count:
+            self.traces.clear()
+            self.trace_episode = self.episode_count
+
+        # the finish line is terminal, so it has no next state value
+        td_error = reward - self.q_table[state, action_idx]
+        if not finished:
+            td_error += self.r_discount * self.q_table[state_new, action_idx_new]
+
+        self.traces.visit(state * self.car.env.n_actions + action_idx)
+        self.traces.update(self.q_table.reshape(-1), self.r_learning * td_error)
@@ -0,0 +1,225 @@
+# -*- coding: utf-8 -*-
+"""
+contains the 'SparseQTable' class, a drop-in alternative to the dense
+action value table for tracks too large to hold densely. the action
+values of a state are only allocated once the state is first visited
+
+@name:          SparseQTable.py
+@author:        J. Tyler Leake
+@last update:   08-19-2024
+"""
+
+import numpy as np
+
+
+# multiplier of the fibonacci hash of state ids into the index
+HASH_MULT = 11400714819323198485
+
+# index key of a free position
+EMPTY = -1
+
+
+
+class SparseQTable:
+
+    def __init__(self, n_states, n_actions, strategy = 'zeros', dtype = np.float64,
+                 rng = None, init_value = 0.0, capacity = 1024):
+
+        if strategy not in ('zeros', 'optimistic', 'random'):
+            raise ValueError(f"unknown q-table initialization strategy '{strategy}'")
+
+        # dense shape of the table this one stands in for
+        self.shape = (n_states, n_actions)
+        self.dtype = np.dtype(dtype)
+
+        # initial action values of a newly visited state: 'default' for
+        # 'zeros'/'optimistic' or uniform [0, 1) draws for 'random'
+        self.strategy = strategy
+        self.default = init_value if strategy == 'optimistic' else 0.0
+        if strategy == 'random' and rng is None:
+            rng = np.random.default_rng(np.random.randint(2**31))
+        self.rng = rng
+
+        # contiguous array of the allocated rows, which doubles in capacity
+        # whenever it fills up
+        self.rows = np.empty((capacity, n_actions), dtype = self.dtype)
+        self.n_rows = 0
+
+        # open addressing hash index of state id -> row of 'rows': 'keys'
+        # holds the state id at each position (EMPTY if free) and 'slots'
+        # its row, probed linearly from the hash of the id. the index
+        # doubles whenever it is half full, so it holds two to four
+        # positions of two ints per state, well under a row of action values
+        self.index_dtype = np.int32 if n_states < 2**31 else np.int64
+        self.keys = None
+        self.slots = None
+        self.shift = None
+        self.rehash(2 * capacity)
+
+    def hash(self, states):
+        '''
+        returns the home position in the index of the state ids given (an
+        int or np array)
+        '''
+        if isinstance(states, np.ndarray):
+            return (states.astype(np.uint64) * np.uint64(HASH_MULT)) >> np.uint64(self.shift)
+        return ((states * HASH_MULT) & 0xFFFFFFFFFFFFFFFF) >> self.shift
+
+    def find(self, state):
+        '''
+        returns the index position of a state id: where it is held, or the
+        free position where it would be added
+        '''
+        keys = self.keys
+        mask = len(keys) - 1
+        pos = self.hash(state)
+
+        key = keys.item(pos)
+        while key != state and key != EMPTY:
+            pos = (pos + 1) & mask
+            key = keys.item(pos)
+
+        return pos
+
+    def rehash(self, index_capacity):
+        '''
+        rebuilds the index with 'index_capacity' positions (a power of two)
+        from the allocated states. the states are probed in rounds: every
+        round, the first state probing each free position takes it and
+        the others move on to the next position
+        '''
+        states = np.empty(0, dtype = np.int64) if self.keys is None else self.visited_states()
+        row_idx = np.arange(len(states))
+
+        self.keys = np.full(index_capacity, EMPTY, dtype = self.index_dtype)
+        self.slots = np.empty(index_capacity, dtype = self.index_dtype)
+        self.shift = 64 - (index_capacity.bit_length() - 1)
+
+        pos = self.hash(states).astype(np.int64)
+        while len(states):
+            free = self.keys[pos] == EMPTY
+            _, first = np.unique(np.where(free, pos, -1), return_index = True)
+            first = first[free[first]]
+
+            self.keys[pos[first]] = states[first]
+            self.slots[pos[first]] = row_idx[first]
+
+            left = np.ones(len(states), dtype = bool)
+            left[first] = False
+            states, row_idx = states[left], row_idx[left]
+            pos = (pos[left] + 1) & (index_capacity - 1)
+
+    def row(self, state):
+        '''
+        returns the action values of a state (a view into the table),
+        allocating them on first visit. the view is only valid until the
+        next state is allocated
+        '''
+        state = int(state)
+        pos = self.find(state)
+
+        if self.keys.item(pos) == state:
+            row_idx = self.slots.item(pos)
+        else:
+            row_idx = self.allocate(state, pos)
+
+        return self.rows[row_idx]
+
+    def allocate(self, state, pos):
+        '''
+        adds an initialized row for the state, at its free index position
+        'pos'; returns its row index
+        '''
+        if self.n_rows == len(self.rows):
+            rows = np.empty((2 * len(self.rows), self.shape[1]), dtype = self.dtype)
+            rows[:self.n_rows] = self.rows
+            self.rows = rows
+
+        row_idx = self.n_rows
+        if self.strategy == 'random':
+            self.rows[row_idx] = self.rng.random(self.shape[1], dtype = self.dtype)
+        else:
+            self.rows[row_idx] = self.default
+
+        self.n_rows += 1
+        if 2 * self.n_rows > len(self.keys):
+            self.rehash(2 * len(self.keys))
+            pos = self.find(state)
+
+        self.keys[pos] = state
+        self.slots[pos] = row_idx
+        return row_idx
+
+    def __getitem__(self, key):
+        '''
+        q_table[state] -> action values; q_table[state, action_idx] -> value
+        '''
+        if isinstance(key, tuple):
+            state, action_idx = key
+            return self.row(state)[action_idx]
+        return self.row(key)
+
+    def __setitem__(self, key, value):
+        '''
+        q_table[state, action_idx] = value; q_table[state] = action values
+        '''
+        if isinstance(key, tuple):
+            state, action_idx = key
+            self.row(state)[action_idx] = value
+        else:
+            self.row(key)[:] = value
+
+    def __len__(self):
+        return self.shape[0]
+
+    def visited_states(self):
+        '''
+        returns the ids of the allocated states, in allocation order
+        '''
+        held = self.keys != EMPTY
+        states = np.empty(np.count_nonzero(held), dtype = np.int64)
+        states[self.slots[held]] = self.keys[held]
+        return states
+
+    def argmax(self, axis = 1):
+        '''
+        returns the greedy action index of every state, as the argmax of
+        a dense table would (unvisited states take action 0)
+        '''
+        if axis != 1:
+            raise ValueError('the sparse q-table only supports argmax over actions')
+
+        greedy = np.zeros(self.shape[0], dtype = np.int64)
+        greedy[self.visited_states()] = self.rows[:self.n_rows].argmax(axis = 1)
+        return greedy
+
+    def to_dense(self):
+        '''
+        returns the table as a dense array; unvisited states hold the
+        default value
+        '''
+        dense = np.full(self.shape, self.default, dtype = self.dtype)
+        dense[self.visited_states()] = self.rows[:self.n_rows]
+        return dense
+
+    @property
+    def nbytes(self):
+        '''
+        bytes held by the table: the allocated rows plus the hash index
+        '''
+        return self.memory_report()['total_bytes']
+
+    def memory_report(self):
+        '''
+        returns the memory use of the table and that of the dense table
+        it stands in for (in bytes)
+        '''
+        rows_bytes = self.rows.nbytes
+        index_bytes = self.keys.nbytes + self.slots.nbytes
+
+        return {'visited_states' : self.n_rows,
+                'capacity'       : len(self.rows),
+                'rows_bytes'     : rows_bytes,
+                'index_bytes'    : index_bytes,
+                'total_bytes'    : rows_bytes + index_bytes,
+                'dense_bytes'    : self.shape[0] * self.shape[1] * self.dtype.itemsize}
@@ -0,0 +1,60 @@
+# -*- coding: utf-8 -*-
+"""
+contains the 'StateIndex' class, which maps the drivable states of a 
+racetrack (track, start and finish cells at every velocity) to a 
+contiguous integer id used to key the environment and learner tables
+
+@name:          StateIndex.py
+@author:        J. Tyler Leake
+@last update:   08-19-2024
+"""
+
+import numpy as np
+
+
+
+class StateIndex:
+    
+    def __init__(self, Racetrack):
+        
+        env = Racetrack
+        
+        # velocity offsets and dimensions
+        self.X_velo_min = env.X_velo_dim[0]
+        self.Y_velo_min = env.Y_velo_dim[0]
+        self.n_Y_velo = env.n_Y_velo
+        self.n_velo = env.n_X_velo * env.n_Y_velo
+        
+        # drivable cells are numbered in row-major order of the map; 
+        # 'cell_index' maps a coordinate to its cell id (-1 for walls) 
+        # and 'cell_cords' maps a cell id back to its coordinate
+        drivable = np.zeros((env.X_cord_dim, env.Y_cord_dim), dtype = bool)
+        drivable_cords = np.array(env.track_cords + env.start_cords + env.finish_cords)
+        drivable[drivable_cords[:, 0], drivable_cords[:, 1]] = True
+        
+        self.cell_cords = np.argwhere(drivable)
+        self.n_cells = len(self.cell_cords)
+        self.cell_index = np.full(drivable.shape, -1, dtype = np.int64)
+        self.cell_index[drivable] = np.arange(self.n_cells)
+        
+        self.n_states = self.n_cells * self.n_velo
+        
+    def encode(self, X_cord, Y_cord, X_velo, Y_velo):
+        '''
+        returns the state id of the drivable coordinates/velocities given; 
+        accepts scalars or np arrays of equal shape
+        '''
+        cell = self.cell_index[X_cord, Y_cord]
+        velo = (X_velo - self.X_velo_min) * self.n_Y_velo + (Y_velo - self.Y_velo_min)
+        return cell * self.n_velo + velo
+    
+    def decode(self, state):
+        '''
+        inverse of 'encode'; returns the x/y coordinates and x/y 
+        velocities of a state id (or np array of ids)
+        '''
+        cell, velo = divmod(state, self.n_velo)
+        X_velo_idx, Y_velo_idx = divmod(velo, self.n_Y_velo)
+        cords = self.cell_cords[cell]
+        return (cords[..., 0], cords[..., 1], 
+                X_velo_idx + self.X_velo_min, Y_velo_idx + self.Y_velo_min)
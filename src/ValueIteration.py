@@ -10,13 +10,17 @@ racetrack problem as a class.
 
 import numpy as np
 from Car import *
-from utils import init_q_table
+from Checkpoint import Checkpoint
+from Profiler import profiler
+import time
 
 
 
 class ValueIteration:
 
-    def __init__(self, car, theta, r_discount, max_itr = 100):
+    def __init__(self, car, theta, r_discount, max_itr = 100, 
+                 sweep_mode = 'synchronous', checkpoint_dir = None, 
+                 checkpoint_every = 10):
         
         # racetrack environment to train on
         self.car = car
@@ -33,148 +37,223 @@ class ValueIteration:
         self.max_itr = max_itr
         self.r_discount = r_discount
         
+        # 'synchronous' sweeps back up every state from the values of the 
+        # previous sweep; 'gauss-seidel' sweeps update the values in place, 
+        # level by level in order of distance to the finish line, so that 
+        # one sweep carries values across the whole track
+        if sweep_mode not in ('synchronous', 'gauss-seidel'):
+            raise ValueError(f"unknown sweep mode '{sweep_mode}'")
+        self.sweep_mode = sweep_mode
+        
         # results
         self.training_results = 0
+        self.test_results = {}
+        
+        # with a 'checkpoint_dir', the tables are memory-mapped files that 
+        # are checkpointed every 'checkpoint_every' sweeps
+        self.checkpoint = None if checkpoint_dir is None else Checkpoint(checkpoint_dir)
+        self.checkpoint_every = checkpoint_every
         
     def init_v_table(self):
         '''
         initializes the state value table for the algorithm with all 
-        possible states set to zero
+        drivable states set to zero
+        '''
+        return np.zeros(self.env.n_states)
+        
+    def get_sweep_levels(self):
+        '''
+        returns the states grouped by the breadth-first distance of their 
+        cell to the finish line, nearest first; the order of the 
+        gauss-seidel sweeps
+        '''
+        env = self.env
+        
+        cell_distance = env.get_finish_distance()
+        state_distance = np.repeat(cell_distance, env.state_index.n_velo)
+        
+        order = np.argsort(state_distance, kind = 'stable')
+        _, level_starts = np.unique(state_distance[order], return_index = True)
+        return np.split(order, level_starts[1:])
+    
+    def action_backups(self, states, restarts):
+        '''
+        returns the one-step backup of every action of the states given 
+        (an index array or slice) from the current state values, as if 
+        the action were applied for sure
         '''
-        X_cord_dim = self.env.X_cord_dim
-        Y_cord_dim = self.env.Y_cord_dim
-        X_velo_dim = abs(self.env.X_velo_dim[1] - self.env.X_velo_dim[0])
-        Y_velo_dim = abs(self.env.Y_velo_dim[1] - self.env.Y_velo_dim[0])
-        return np.zeros([X_cord_dim, Y_cord_dim, X_velo_dim, Y_velo_dim])
+        env = self.env
         
-    def train(self):
+        # value of the state each action lands in
+        next_state_vals = self.v_table[env.next_state[states]]
+        if restarts is not None:
+            next_state_vals[restarts[states]] = self.v_table[env.start_states].mean()
+        
+        # the finish line is terminal and yields zero reward
+        backups = env.reward + self.r_discount * next_state_vals
+        backups[env.finished[states]] = 0
+        return backups
+    
+    def backup(self, states, restarts):
+        '''
+        returns the q-values of the states given (an index array or slice) 
+        from a one-step bellman backup of the current state values
         '''
-        implementation of the value iteration algorithm 
+        env = self.env
+        noop_idx = env.action_idx[(0, 0)]
+        backups = self.action_backups(states, restarts)
+        
+        # expected q-value under the transition probability: the 
+        # chosen action is applied with p_transition, else nothing
+        q_vals = env.p_transition * backups
+        q_vals += (1 - env.p_transition) * backups[:, noop_idx, None]
+        return q_vals
+    
+    def sweep(self, levels, restarts):
         '''
-        car = self.car
+        backs up every state once, level by level (a single level holding 
+        every state is a synchronous sweep); updates the value, action 
+        value and policy tables and returns the largest value change
+        '''
+        max_q_delta = 0
+        
+        for states in levels:
+            
+            q_vals = self.backup(states, restarts)
+            self.q_table[states] = q_vals
+            
+            # update the state value and policy tables from the best action
+            max_q_vals = q_vals.max(axis = 1)
+            max_q_delta = max(max_q_delta, np.max(np.abs(max_q_vals - self.v_table[states])))
+            self.v_table[states] = max_q_vals
+            self.p_table[states] = q_vals.argmax(axis = 1)
+        
+        return max_q_delta
+    
+    def train(self, resume = False):
+        '''
+        implementation of the value iteration algorithm. each sweep is a 
+        bellman backup of every state/action pair computed in batches from 
+        the environment's transition tables: one batch for synchronous 
+        sweeps, one per finish distance level for gauss-seidel sweeps. with 
+        'resume', the sweeps continue from the last checkpoint (if any)
+        '''
+        env = self.env
+        
+        if env.next_state is None: 
+            env.build_transition_tables()
+        
+        itr = 0
+        self.training_results = {}
+        
+        if resume and self.checkpoint is not None: 
+            itr = self.load_checkpoint()
 
         # initialize the state value table V(s); the action-value 
-        # table Q(s); and policy table P
-        self.v_table = self.init_v_table()
-        self.q_table = init_q_table(self.env)
-        self.p_table = self.init_v_table()
-
+        # table Q(s); and policy table P (action indices)
+        if not resume or itr == 0:
+            self.v_table = self.init_v_table()
+            self.q_table = np.zeros((env.n_states, env.n_actions))
+            self.p_table = np.zeros(env.n_states, dtype = np.int64)
+            
+            if self.checkpoint is not None: 
+                self.v_table = self.checkpoint.create_table('v_table', self.v_table)
+                self.q_table = self.checkpoint.create_table('q_table', self.q_table)
+                self.p_table = self.checkpoint.create_table('p_table', self.p_table)
+        
+        # under the 'restart' crash policy a crash sends the car to a 
+        # random starting point; its value is the mean over the start line
+        restarts = None
+        if self.car.crash_type == 'restart':
+            restarts = env.crashed & ~env.finished
+        
+        if self.sweep_mode == 'gauss-seidel':
+            levels = self.get_sweep_levels()
+        else:
+            levels = [slice(None)]
+        
         # stopping criteria: train until either the delta val has reached 
         # the threshold or the max number of iterations has been reached
         
-        done = False
+        done = itr >= self.max_itr
         
         while not done: 
-
-            max_q_delta = 0 
-        
-            # for each state in the environment
-            for X_cord in range(self.env.X_cord_dim):
-                for Y_cord in range(self.env.Y_cord_dim):
-                    for X_velo in range(10):
-                        for Y_velo in range(10):
-                            
-                            # retrieve the current state value from the table
-                            old_state_val = self.v_table[X_cord, Y_cord, X_velo, Y_velo]
             
-                            # for each action the car can taken in the env,
-                            # find the state/action pair with max reward
-                            
-                            max_action = None
-                            max_q_val = -10000
-                            
-                            for action in self.env.actions:
-                                
-                                # retrieve the car's coordinates and velocity attr.
-                                car.cur_cord = [X_cord, Y_cord]
-                                car.cur_velo = [X_velo, Y_velo]
-                                
-                                car.update_state(action) # perform the action
-                                
-                                # store the new state values from the action
-                                X_cord_new = car.cur_cord[0]
-                                Y_cord_new = car.cur_cord[1]
-                                X_velo_new = car.cur_velo[0]
-                                Y_velo_new = car.cur_velo[1]
-                                
-                                # check if the car has finished. if true, set the 
-                                # reward to 0; else retrieve next state from v_table
-                                
-                                next_state_val = None
-                                reward = self.env.reward
-                                
-                                if car.is_finished: 
-                                    reward = 0 
-                                
-                                if not car.is_finished: 
-                                    next_state_val = self.v_table[X_cord_new, Y_cord_new, 
-                                                                  X_velo_new, Y_velo_new]
-                                    
-                                # compute the q-value of the state/action pair;
-                                # insert this value into q_table
-                                q_val = reward + (self.r_discount * next_state_val)
-                                self.q_table[X_cord, Y_cord, X_velo, Y_velo, action] = q_val
-                                
-                                # update outer loop vars if q value is new max
-                                if q_val > max_q_val:
-                                    best_action = action
-                                    max_q_val = q_val
-                                    
-                            # update the state value table from the best action
-                            old_q_val = self.v_table[X_cord, Y_cord, X_velo, Y_velo]
-                            self.v_table[X_cord, Y_cord, X_velo, Y_velo] = max_q_val
-                            self.p_table[X_cord, Y_cord, X_velo, Y_velo] = max_action
-                            
-                            # update the max_q_delta var if new delta is greater
-                            q_val_delta = (old_q_val - max_q_val)
-                            
-                            if q_val_delta > max_q_delta: 
-                                max_q_delta = q_val_delta
+            sweep_start = time.perf_counter()
+            max_q_delta = self.sweep(levels, restarts)
                                   
+            if profiler.enabled: 
+                profiler.count('sweeps')
+                profiler.add_time('ValueIteration.sweep', time.perf_counter() - sweep_start)
+            
             # stopping criteria
+            self.training_results[itr] = max_q_delta
             itr += 1                        
-            done = False if (max_q_delta > self.theta and itr < self.max_iter) else True
+            done = False if (max_q_delta > self.theta and itr < self.max_itr) else True
+            
+            if self.checkpoint is not None and (done or itr % self.checkpoint_every == 0):
+                self.checkpoint.save({'itr'          : itr, 
+                                      'sweep_deltas' : list(self.training_results.values())})
+    
+    def load_checkpoint(self):
+        '''
+        restores the v/q/p tables and the value change of every sweep so 
+        far from the last checkpoint; returns the number of sweeps already 
+        done (zero if there is no checkpoint)
+        '''
+        state = self.checkpoint.load()
+        if state is None: 
+            return 0
+        
+        self.v_table = self.checkpoint.restore_table('v_table')
+        self.q_table = self.checkpoint.restore_table('q_table')
+        self.p_table = self.checkpoint.restore_table('p_table')
+        self.training_results = dict(enumerate(state['sweep_deltas']))
+        return state['itr']
                            
-        def test(self):
-            '''
-            testing simulator for the algorithm. executes the learned policy from
-            training on a fresh raceterack environment. 
-            '''
-            self.car.restart_env() # reset the car's state; place at starting line
+    def test(self):
+        '''
+        testing simulator for the algorithm. executes the learned policy from
+        training on a fresh raceterack environment. 
+        '''
+        self.car.restart_env() # reset the car's state; place at starting line
+        
+        # iterate until either the agent has reached the finish 
+        # line or the 'max_itr' is hit
+        
+        test_itr = 0
+        done = False
+        
+        while not done:
             
-            # iterate until either the agent has reached the finish 
-            # line or the 'max_itr' is hit
+            # retrive the current state of the car
+            X_cord = self.car.X_cord_cur
+            Y_cord = self.car.Y_cord_cur
+            X_velo = self.car.X_velo
+            Y_velo = self.car.Y_velo
             
-            test_itr = 0
-            done = False
+            s = (X_cord, Y_cord, X_velo, Y_velo)
             
-            while not done:
-                
-                # retrive the current state of the car
-                X_cord = self.car.X_cord_cur
-                Y_cord = self.car.Y_cord_cur
-                X_velo = self.car.X_velo
-                Y_velo = self.car.Y_velo
-                
-                s = (X_cord, Y_cord, X_velo, Y_velo)
-                
-                # retieve the action from the policy and perform it
-                action = self.p_table[X_cord,Y_cord, X_velo, Y_velo]
-                self.car.update_state(action)
-                
-                # retrive the next state of the car
-                X_cord = self.car.X_cord_cur
-                Y_cord = self.car.Y_cord_cur
-                X_velo = self.car.X_velo
-                Y_velo = self.car.Y_velo
-                
-                s_prime = (X_cord, Y_cord, X_velo, Y_velo)
-                
-                # stopping criteria: check if car has finished or if the 
-                # max_itr has been hit; if true, terminate
-                test_itr += 1
-                if self.car.is_finished: done = True
-                if test_itr >= 500: done = True
-                
-                print(s, action, s_prime)
-                
+            # retieve the action from the policy and perform it
+            state = self.env.encode_state(X_cord, Y_cord, X_velo, Y_velo)
+            action = self.env.actions[self.p_table[state]]
+            self.car.update_state(action)
+            
+            # retrive the next state of the car
+            X_cord = self.car.X_cord_cur
+            Y_cord = self.car.Y_cord_cur
+            X_velo = self.car.X_velo
+            Y_velo = self.car.Y_velo
+            
+            s_prime = (X_cord, Y_cord, X_velo, Y_velo)
+            
+            # stopping criteria: check if car has finished or if the 
+            # max_itr has been hit; if true, terminate
+            test_itr += 1
+            if self.car.is_finished: done = True
+            if test_itr >= 500: done = True
+            
+            print(s, action, s_prime)
+        
+        # record the number of steps taken in this test run
+        self.test_results[len(self.test_results)] = test_itr
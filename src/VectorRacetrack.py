@@ -0,0 +1,113 @@
+# -*- coding: utf-8 -*-
+"""
+contains the 'VectorRacetrack' class, a batched form of the 'Car' agent
+that steps N cars through the same racetrack environment in lockstep
+with their states held as np arrays
+
+@name:          VectorRacetrack.py
+@author:        J. Tyler Leake
+@last update:   08-19-2024
+"""
+
+import numpy as np
+
+
+
+class VectorRacetrack:
+
+    def __init__(self, Racetrack, n_cars, crash_type = ['nearest', 'restart'],
+                 seed = None):
+
+        # shared enviornment + attributes for crash handling
+        self.env = Racetrack
+        self.n_cars = n_cars
+        self.crash_type = crash_type
+        self.rng = np.random.default_rng(seed)
+
+        # action index -> x/y acceleration; start line coordinates
+        self.accels = np.array(self.env.actions)
+        self.start_cords = np.array(self.env.start_cords)
+
+        # state values of every car in the environment and the number
+        # of steps each car has taken in its current episode
+        self.X_cord = np.zeros(n_cars, dtype = np.int64)
+        self.Y_cord = np.zeros(n_cars, dtype = np.int64)
+        self.X_velo = np.zeros(n_cars, dtype = np.int64)
+        self.Y_velo = np.zeros(n_cars, dtype = np.int64)
+        self.ep_steps = np.zeros(n_cars, dtype = np.int64)
+
+        self.restart_env() # initialize every car at starting line
+
+    def restart_env(self, mask = None):
+        '''
+        places the cars selected by the boolean 'mask' (all cars if none)
+        at random starting points in the map and sets their velocity and
+        episode step count to zero
+        '''
+        if mask is None:
+            mask = np.ones(self.n_cars, dtype = bool)
+
+        n_restarts = np.count_nonzero(mask)
+        if n_restarts == 0:
+            return
+
+        restart_cords = self.start_cords[self.rng.integers(len(self.start_cords),
+                                                           size = n_restarts)]
+        self.X_cord[mask] = restart_cords[:, 0]
+        self.Y_cord[mask] = restart_cords[:, 1]
+        self.X_velo[mask] = 0
+        self.Y_velo[mask] = 0
+        self.ep_steps[mask] = 0
+
+    def get_states(self):
+        '''
+        returns the state id of every car in the environment
+        '''
+        return self.env.encode_state(self.X_cord, self.Y_cord, self.X_velo, self.Y_velo)
+
+    def update_state(self, action_idx):
+        '''
+        applies one action to every car; crashed cars are handled per
+        the crash policy and finished cars are restarted at the start line
+
+        args:
+        action_idx (np arr): index of the action to apply to each car
+
+        return:
+        state ids after the step (after any restart), per-car rewards,
+        finished flags, and the episode step count of each car at the
+        step (so the length of the episodes just finished can be read)
+        '''
+        X_accl = self.accels[action_idx, 0]
+        Y_accl = self.accels[action_idx, 1]
+
+        X_new, Y_new, X_velo_new, Y_velo_new, finished, crashed = \
+            self.env.simulate(self.X_cord, self.Y_cord, self.X_velo, self.Y_velo,
+                              X_accl, Y_accl)
+
+        self.X_cord, self.Y_cord = X_new, Y_new
+        self.X_velo, self.Y_velo = X_velo_new, Y_velo_new
+        self.ep_steps += 1
+        ep_steps = self.ep_steps.copy()
+
+        # a finish takes precedence over a crash on the same move
+        crashed &= ~finished
+
+        # place crashed cars at the nearest track coordinate; reset speed
+        if self.crash_type == 'nearest' and crashed.any():
+            self.X_cord[crashed], self.Y_cord[crashed] = \
+                self.env.nearest_relief(X_new[crashed], Y_new[crashed])
+            self.X_velo[crashed], self.Y_velo[crashed] = 0, 0
+
+        # place crashed cars at the starting line; the episode continues
+        if self.crash_type == 'restart' and crashed.any():
+            steps = self.ep_steps[crashed]
+            self.restart_env(crashed)
+            self.ep_steps[crashed] = steps
+
+        # finished cars begin a new episode at the starting line
+        self.restart_env(finished)
+
+        rewards = np.where(finished, 0, self.env.reward)
+
+        return self.get_states(), rewards, finished, ep_steps
@@ -1,149 +1,420 @@
-# -*- coding: utf-8 -*-
-"""
-contains an overhead 'Experiment' class used to test the Racetrack problem
-with the RL algorithms implemented in the project and collect results
-
-@name:          __main__.py
-@author:        J. Tyler Leake
-@last update:   08-19-2024
-"""
-
-import numpy as np
-from statistics import mean
-import matplotlib as plt
-from Racetrack import *
-from Car import *
-from ValueIteration import *
-from QLearning import *
-from SARSA import *
-
-
-
-class Experiment:
-    
-    def __init__(self, 
-                 racetrack_path, 
-                 crash_type = ['nearest', 'restart'], 
-                 algorithm = ['VI', 'QL', 'SARSA'], 
-                 n_experiments = 10, 
-                 n_rand_samples = 100):
-                 
-        # required attrributes
-        self.env = Racetrack(racetrack_path)
-        self.car = Car(self.env, crash_type)
-        self.alg = algorithm
-        
-        # results 
-        self.n_experiments = n_experiments 
-        self.cumulative_rewards = None
-        self.learning_curve_data = None
-        
-        # hyperparameter attributes
-        self.n_rand_samples = n_rand_samples
-        self.best_hyparams = {}
-        
-        self.candidate_hyperparams = {
-        'learning rate'     : np.linspace(0.01, 0.5, 25),
-        'discount rate'     : np.linspace(0.95, 0.99, 5),
-        'decay rate'        : np.linspace(0.95, 0.99, 5),
-        'epsilon'           : np.linspace(0.01, 1, 100),
-        'theta'             : np.linspace(0.01, 0.1, 10)}
-
-    def run_procedure(self):
-        '''
-        overhead procedure for experiment. find the best hyperparameter 
-        values using random search, then test with best hyperparameters
-        '''
-        self.random_search()
-        self.train_and_test(self.alg, self.best_hyparams, tuning = False)
-    
-    def random_search(self):
-        '''
-        implementation of random search for hyperparameter tuning. trains
-        and tests a model on each hyperparam set, recording results
-        '''
-        # get random hyperparamter samples
-        hyparams = self.get_rand_samples() 
-        
-        # for each hyperparameter sample, train and test a model using
-        # the relevant algorithm. record the results
-        hyparam_results = {}
-        for hyparam_set in hyparams:
-            results = self.train_and_test(self.alg, hyparam_set, tuning = True)
-            mean_result = mean(list(results.values()))
-            hyparam_results[tuple(hyparam_set.items())] = mean_result
-        
-        # identify and store the best set of hyperparameters
-        self.best_hyparams = dict(min(hyparam_results, key=hyparam_results.get))
-
-    def get_rand_samples(self):
-        '''
-        generates random hyperparameter sample for random search tuning
-        '''
-        param_sets = []
-        for _ in range(self.n_rand_samples):
-            sampled_params = {}
-            for hyp_param, param_range in self.candidate_hyperparams.items():
-                if isinstance(param_range, list):
-                    sample = np.random.choice(param_range)
-                else:
-                    sample = np.random.uniform(min(param_range), max(param_range))
-                sampled_params[hyp_param] = sample
-            param_sets.append(sampled_params)
-        return param_sets
-    
-    def train_and_test(self, algorithm, hyparams, tuning = False):
-        '''
-        trains a model using the experiment's attribute using the racetrack 
-        env attribute; returns the experiment results 
-        '''
-        
-        r_learning = hyparams['learning rate']
-        r_discount = hyparams['discount rate']
-        r_decay = hyparams['decay rate']
-        p_explore = hyparams['epsilon']
-        
-        train_performance = {}
-        test_performance = {}
-        Lcurve_data = {}
-        
-        for exp_no in range(self.n_experiments):
-        
-            if algorithm == 'VI':
-                exp = ValueIteration(self.car, r_learning, r_discount, r_decay, p_explore)
-                exp.train()
-                exp.test()
-                train_performance[exp_no] = exp.training_results
-                test_performance[exp_no] = exp.test_results
-                if not tuning: Lcurve_data[exp_no] = list(exp.training_results.values())
-            
-            if algorithm == 'QL':
-                exp = QLearning(self.car, r_learning, r_discount, r_decay, p_explore)
-                exp.train()
-                exp.test()
-                mean_train_steps = mean(list(exp.training_results.values()))
-                mean_test_steps = mean(list(exp.testimg_results.values()))
-                train_performance[exp_no] = mean_train_steps
-                test_performance[exp_no] = mean_test_steps
-                test_performance[exp_no] = mean_test_steps
-                if not tuning: Lcurve_data[exp_no] = list(exp.training_results.values())
-                
-            if algorithm == 'SARSA':
-                exp = SARSA(self.car, r_learning, r_discount, r_decay, p_explore)
-                exp.train()
-                exp.test()
-                mean_train_steps = mean(list(exp.training_results.values()))
-                mean_test_steps = mean(list(exp.testimg_results.values()))
-                train_performance[exp_no] = mean_train_steps
-                test_performance[exp_no] = mean_test_steps
-                test_performance[exp_no] = mean_test_steps
-                if not tuning: Lcurve_data[exp_no] = list(exp.training_results.values())
-                    
-        if tuning:
-            return experiments
-        
-        if not tuning:
-            self.cumulative_rewards = cumulative_rewards
-            self.learning_curve_data = learning_curve_data
-            
-        
+# -*- coding: utf-8 -*-
+"""
+contains an overhead 'Experiment' class used to test the Racetrack problem
+with the RL algorithms implemented in the project and collect results
+
+@name:          __main__.py
+@author:        J. Tyler Leake
+@last update:   08-19-2024
+"""
+
+import numpy as np
+import os
+from statistics import mean
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+import matplotlib as plt
+from Racetrack import *
+from Car import *
+from ValueIteration import *
+from PolicyIteration import *
+from PrioritizedSweeping import *
+from MultiResolutionVI import *
+from QLearning import *
+from DynaQ import *
+from SARSA import *
+from QLambda import *
+from SARSALambda import *
+from utils import set_seed
+from MetricsLog import MetricsLog, MetricsReader
+from Policy import export_policy, rollout
+from Profiler import profiler
+
+
+
+# model-based planners: trained to convergence, with no episode budget
+PLANNERS = ('VI', 'PI', 'PS', 'MR')
+
+
+
+class Experiment:
+    
+    def __init__(self, 
+                 racetrack_path, 
+                 crash_type = ['nearest', 'restart'], 
+                 algorithm = ['VI', 'PI', 'PS', 'MR', 'QL', 'DQ', 'SARSA', 
+                              'QLambda', 'SARSALambda'], 
+                 n_experiments = 10, 
+                 n_rand_samples = 100, 
+                 seed = None, 
+                 metrics_dir = None, 
+                 n_test_episodes = 10, 
+                 profile = False, 
+                 track_cache_dir = None):
+                 
+        # required attrributes
+        self.racetrack_path = racetrack_path
+        self.crash_type = crash_type
+        self.track_cache_dir = track_cache_dir
+        self.env = Racetrack(racetrack_path, cache_dir = track_cache_dir)
+        self.car = Car(self.env, crash_type)
+        self.alg = algorithm
+        self.seed = seed
+        
+        # results 
+        self.n_experiments = n_experiments 
+        self.train_performance = None
+        self.test_performance = None
+        self.cumulative_rewards = None
+        self.learning_curve_data = None
+        self.profile_reports = None
+        
+        # if set, QL/DQ/SARSA training records of the final (non-tuning) runs 
+        # are streamed to a metrics log per repeat under this directory
+        self.metrics_dir = metrics_dir
+        
+        # test episodes per start cell when evaluating a trained policy
+        self.n_test_episodes = n_test_episodes
+        
+        # if set, the final (non-tuning) runs are profiled: step, crash, 
+        # finish and explore/exploit counts plus hot path timings
+        self.profile = profile
+        
+        # hyperparameter attributes
+        self.n_rand_samples = n_rand_samples
+        self.best_hyparams = {}
+        
+        self.candidate_hyperparams = {
+        'learning rate'     : np.linspace(0.01, 0.5, 25),
+        'discount rate'     : np.linspace(0.95, 0.99, 5),
+        'decay rate'        : np.linspace(0.95, 0.99, 5),
+        'epsilon'           : np.linspace(0.01, 1, 100),
+        'theta'             : np.linspace(0.01, 0.1, 10)}
+
+    def run_procedure(self, tuning = ['random', 'halving']):
+        '''
+        overhead procedure for experiment. find the best hyperparameter 
+        values using random search (or successive halving), then test 
+        with best hyperparameters
+        '''
+        if tuning == 'halving': 
+            self.successive_halving()
+        else: 
+            self.random_search()
+        
+        seed = None if self.seed is None else (self.seed,)
+        self.train_and_test(self.alg, self.best_hyparams, tuning = False, seed = seed)
+    
+    def random_search(self, n_workers = 1, chunk_size = 1):
+        '''
+        implementation of random search for hyperparameter tuning. trains
+        and tests a model on each hyperparam set, recording results. with 
+        'n_workers' > 1 the sets are spread over a process pool in chunks 
+        of 'chunk_size'; every run is seeded from the experiment seed, the 
+        sample number and the repeat number
+        '''
+        # seed every run; parallel runs are always seeded so that forked 
+        # workers do not share the same random state
+        base_seed = self.seed
+        if base_seed is None and n_workers > 1:
+            base_seed = np.random.SeedSequence().entropy
+        if base_seed is not None:
+            set_seed(base_seed)
+        
+        # get random hyperparamter samples
+        hyparams = self.get_rand_samples() 
+        seeds = [None if base_seed is None else (base_seed, sample_no) 
+                 for sample_no in range(len(hyparams))]
+        
+        # for each hyperparameter sample, train and test a model using
+        # the relevant algorithm. results are returned in sample order
+        if n_workers > 1:
+            worker_args = (self.get_worker_args(),)
+            with ProcessPoolExecutor(n_workers, initializer = init_worker, 
+                                     initargs = worker_args) as pool:
+                all_results = list(pool.map(run_hyparam_set, zip(hyparams, seeds), 
+                                            chunksize = chunk_size))
+        else:
+            all_results = [self.train_and_test(self.alg, hyparam_set, tuning = True, 
+                                               seed = seed) 
+                           for hyparam_set, seed in zip(hyparams, seeds)]
+        
+        # record the results
+        hyparam_results = {}
+        for hyparam_set, results in zip(hyparams, all_results):
+            mean_result = mean(list(results.values()))
+            hyparam_results[tuple(hyparam_set.items())] = mean_result
+        
+        # identify and store the best set of hyperparameters
+        self.best_hyparams = dict(min(hyparam_results, key=hyparam_results.get))
+
+    def successive_halving(self, eta = 3):
+        '''
+        successive halving for hyperparameter tuning. the sampled sets are 
+        trained in rounds; after each round only the best 1/eta of the 
+        sets (by mean steps-to-finish over the episodes of the round) 
+        continue, until one set remains. the episodes trained by the end 
+        of each round grow by eta per round, up to the learner's full 
+        episode budget in the last one. the planners have no episode 
+        budget and use random search
+        '''
+        if self.alg in PLANNERS:
+            self.random_search()
+            return
+        
+        if self.seed is not None: 
+            set_seed(self.seed)
+        
+        # one learner per hyperparameter sample; each keeps its q_table 
+        # between rounds so that survivors continue where they left off
+        hyparams = self.get_rand_samples()
+        learners = [self.build_learner(self.alg, hyparam_set) for hyparam_set in hyparams]
+        survivors = list(range(len(hyparams)))
+        
+        # one round per cut down to a single set (at most one per episode 
+        # of the budget; the last round then keeps only the best set)
+        full_budget = learners[0].episodes
+        n_rounds, n_sets = 0, len(survivors)
+        while n_sets > 1 and n_rounds < full_budget:
+            n_sets = max(1, n_sets // eta)
+            n_rounds += 1
+        
+        # episodes trained by the end of each round (its rung): the full 
+        # budget in the last round, 1/eta of the next rung before it and 
+        # at least one more episode every round
+        rungs = [max(round_no + 1, full_budget // eta**(n_rounds - 1 - round_no)) 
+                 for round_no in range(n_rounds)]
+        
+        trained = 0
+        for round_no, rung in enumerate(rungs):
+            
+            # train each surviving set up to the round's rung and score 
+            # it on the mean steps of the episodes of this round
+            budget = rung - trained
+            scores = {}
+            for sample_no in survivors:
+                if self.seed is not None: 
+                    set_seed(self.seed, sample_no, round_no)
+                learner = learners[sample_no]
+                learner.episodes = budget
+                learner.train(resume = round_no > 0)
+                round_steps = list(learner.training_results.values())[-budget:]
+                scores[sample_no] = mean(round_steps)
+            trained = rung
+            
+            # keep the best fraction (freeing the tables of the rest)
+            survivors = sorted(survivors, key = scores.get)
+            n_keep = 1 if round_no == n_rounds - 1 else max(1, len(survivors) // eta)
+            for sample_no in survivors[n_keep:]: 
+                learners[sample_no] = None
+            survivors = survivors[:n_keep]
+        
+        # identify and store the best set of hyperparameters
+        self.best_hyparams = hyparams[survivors[0]]
+    
+    def build_learner(self, algorithm, hyparams, car = None, metrics = None):
+        '''
+        returns an untrained ValueIteration, PolicyIteration, 
+        PrioritizedSweeping, MultiResolutionVI, QLearning, DynaQ, SARSA, 
+        QLambda or SARSALambda model for the hyperparameter set, acting on 
+        'car' (the experiment's car if none is given); the learners stream 
+        to the 'metrics' log if given
+        '''
+        car = self.car if car is None else car
+        
+        if algorithm == 'VI':
+            return ValueIteration(car, hyparams['theta'], hyparams['discount rate'])
+        
+        if algorithm == 'PI':
+            return PolicyIteration(car, hyparams['theta'], hyparams['discount rate'])
+        
+        if algorithm == 'PS':
+            return PrioritizedSweeping(car, hyparams['theta'], hyparams['discount rate'])
+        
+        if algorithm == 'MR':
+            return MultiResolutionVI(car, hyparams['theta'], hyparams['discount rate'])
+        
+        learner = {'QL'          : QLearning, 
+                   'DQ'          : DynaQ, 
+                   'SARSA'       : SARSA, 
+                   'QLambda'     : QLambda, 
+                   'SARSALambda' : SARSALambda}[algorithm]
+        return learner(car, hyparams['learning rate'], hyparams['discount rate'], 
+                       hyparams['decay rate'], hyparams['epsilon'], metrics = metrics)
+    
+    def get_worker_args(self):
+        '''
+        returns the constructor arguments that rebuild this experiment 
+        in a process pool worker
+        '''
+        return {'racetrack_path'  : self.racetrack_path, 
+                'crash_type'      : self.crash_type, 
+                'algorithm'       : self.alg, 
+                'n_experiments'   : self.n_experiments, 
+                'metrics_dir'     : self.metrics_dir, 
+                'n_test_episodes' : self.n_test_episodes, 
+                'profile'         : self.profile, 
+                'track_cache_dir' : self.track_cache_dir}
+    
+    def get_rand_samples(self):
+        '''
+        generates random hyperparameter sample for random search tuning
+        '''
+        param_sets = []
+        for _ in range(self.n_rand_samples):
+            sampled_params = {}
+            for hyp_param, param_range in self.candidate_hyperparams.items():
+                if isinstance(param_range, list):
+                    sample = np.random.choice(param_range)
+                else:
+                    sample = np.random.uniform(min(param_range), max(param_range))
+                sampled_params[hyp_param] = sample
+            param_sets.append(sampled_params)
+        return param_sets
+    
+    def train_and_test(self, algorithm, hyparams, tuning = False, seed = None, 
+                       concurrency = [None, 'process', 'thread'], n_workers = None):
+        '''
+        trains a model using the experiment's attribute using the racetrack 
+        env attribute; returns the experiment results. if a 'seed' tuple 
+        is given, each repeat is seeded from it and its repeat number. 
+        
+        each repeat runs on its own car, so the repeats can run in a 
+        'process' pool (each worker loads its own racetrack) or a 'thread' 
+        pool of 'n_workers'; threads share the global random state, so 
+        seeded thread runs are not reproducible. profiled runs cannot use 
+        threads: the repeats would share the global profiler
+        '''
+        if concurrency == 'thread' and self.profile and not tuning:
+            raise ValueError('profiled repeats cannot run in a thread pool')
+        
+        # forked workers copy the global random state, so unseeded process 
+        # repeats are seeded from fresh entropy to keep them independent
+        if seed is None and concurrency == 'process':
+            seed = (np.random.SeedSequence().entropy,)
+        
+        jobs = [(algorithm, hyparams, exp_no, tuning, seed) 
+                for exp_no in range(self.n_experiments)]
+        
+        if concurrency == 'process':
+            worker_args = (self.get_worker_args(),)
+            with ProcessPoolExecutor(n_workers, initializer = init_worker, 
+                                     initargs = worker_args) as pool:
+                results = list(pool.map(run_repeat_job, jobs))
+                
+        elif concurrency == 'thread':
+            with ThreadPoolExecutor(n_workers) as pool:
+                results = list(pool.map(lambda job: self.run_repeat(*job), jobs))
+                
+        else:
+            results = [self.run_repeat(*job) for job in jobs]
+        
+        # merge the results of the repeats
+        train_performance = {}
+        test_performance = {}
+        Lcurve_data = {}
+        profile_reports = {}
+        
+        for exp_no, (train_result, test_result, Lcurve, report) in enumerate(results):
+            train_performance[exp_no] = train_result
+            test_performance[exp_no] = test_result
+            if not tuning: Lcurve_data[exp_no] = Lcurve
+            if report is not None: profile_reports[exp_no] = report
+                    
+        if tuning:
+            return test_performance
+        
+        if not tuning:
+            self.train_performance = train_performance
+            self.test_performance = test_performance
+            self.cumulative_rewards = {exp_no: self.env.reward * steps 
+                                       for exp_no, steps in test_performance.items()}
+            self.learning_curve_data = Lcurve_data
+            self.profile_reports = profile_reports if self.profile else None
+    
+    def run_repeat(self, algorithm, hyparams, exp_no, tuning = False, seed = None):
+        '''
+        trains and tests one repeat of the experiment on a fresh car. 
+        
+        return: 
+        training performance (number of iterations for VI/PI/MR, of sweeps' 
+        worth of updates for PS; mean steps per episode otherwise), mean 
+        test steps over the policy rollouts and 
+        learning curve data (a 'MetricsReader' when the run streams to a 
+        metrics log) and the profiler report of training (none unless 
+        the experiment is profiled)
+        '''
+        if seed is not None: 
+            set_seed(*seed, exp_no)
+        
+        # final QL/DQ/SARSA runs stream their records to a metrics log
+        metrics = None
+        if self.metrics_dir is not None and not tuning and algorithm not in PLANNERS:
+            log_dir = os.path.join(self.metrics_dir, f'{algorithm}-{exp_no}')
+            metrics = MetricsLog(log_dir)
+        
+        car = Car(self.env, self.crash_type)
+        exp = self.build_learner(algorithm, hyparams, car, metrics)
+        
+        report = None
+        if self.profile and not tuning: 
+            profiler.reset()
+            profiler.enable()
+            try:
+                exp.train()
+            finally:
+                profiler.disable()
+            report = profiler.report()
+        else:
+            exp.train()
+        
+        # test: greedy rollouts of the compiled policy from every start cell
+        policy = export_policy(exp)
+        test_steps = rollout(self.env, policy, self.crash_type, self.n_test_episodes)
+        
+        if algorithm in PLANNERS:
+            train_result = len(exp.training_results)
+        elif metrics is not None:
+            train_result = MetricsReader(log_dir).mean('steps')
+        else:
+            train_result = mean(list(exp.training_results.values()))
+            
+        test_result = float(test_steps.mean())
+        
+        # learning curve: read lazily from the metrics log if streamed
+        Lcurve = None
+        if not tuning: 
+            Lcurve = MetricsReader(log_dir) if metrics is not None \
+                     else list(exp.training_results.values())
+        
+        return train_result, test_result, Lcurve, report
+            
+
+
+# process pool workers for the parallel hyperparameter search and 
+# repeats. each worker builds its own experiment (and so loads the 
+# track) once
+
+worker_experiment = None
+
+def init_worker(experiment_args):
+    '''
+    process pool initializer; loads the racetrack for the worker
+    '''
+    global worker_experiment
+    worker_experiment = Experiment(**experiment_args)
+
+def run_hyparam_set(job):
+    '''
+    trains and tests a model on one (hyperparameter set, seed) job in 
+    a worker process; returns the test results
+    '''
+    hyparam_set, seed = job
+    return worker_experiment.train_and_test(worker_experiment.alg, hyparam_set, 
+                                            tuning = True, seed = seed)
+
+def run_repeat_job(job):
+    '''
+    trains and tests one repeat of an experiment (a 'run_repeat' 
+    argument tuple) in a worker process
+    '''
+    return worker_experiment.run_repeat(*job)
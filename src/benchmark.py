@@ -0,0 +1,336 @@
+# -*- coding: utf-8 -*-
+"""
+benchmark suite for the racetrack problem. for every track in the
+'track-data' directory it measures the simulator, planner and learner
+throughput and the memory held by the tables, writes the results to a
+json file and compares them against a stored baseline. every metric is
+the median of several runs, and only a change beyond the spread of its
+runs counts as a regression
+
+usage:
+python benchmark.py --out results.json --baseline baseline.json
+
+@name:          benchmark.py
+@author:        J. Tyler Leake
+@last update:   08-19-2024
+"""
+
+import argparse
+import glob
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+from statistics import median, quantiles
+from Racetrack import Racetrack
+from Car import Car
+from ValueIteration import ValueIteration
+from PolicyIteration import PolicyIteration
+from PrioritizedSweeping import PrioritizedSweeping
+from MultiResolutionVI import MultiResolutionVI
+from QLearning import QLearning
+from DynaQ import DynaQ
+from SARSA import SARSA
+from QLambda import QLambda
+from SARSALambda import SARSALambda
+from utils import set_seed
+
+
+TRACK_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'track-data')
+
+# metrics where a larger value is better; for all others smaller is better
+HIGHER_IS_BETTER = ('steps_per_sec', 'episodes_per_sec')
+
+
+
+def bench_load(track_path, cache_dir):
+    '''
+    returns the seconds a track takes to load from its file and from the
+    track cache in 'cache_dir'
+    '''
+    start = time.perf_counter()
+    Racetrack(track_path)
+    load_seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    Racetrack(track_path, cache_dir = cache_dir)
+    return load_seconds, time.perf_counter() - start
+
+
+def bench_car_steps(env, crash_type, n_steps):
+    '''
+    returns the raw 'Car.update_state' steps per second under random actions
+    '''
+    car = Car(env, crash_type)
+    actions = [env.actions[random.randrange(env.n_actions)] for _ in range(n_steps)]
+
+    start = time.perf_counter()
+    for action in actions:
+        car.update_state(action)
+        if car.is_finished:
+            car.restart_env()
+    return n_steps / (time.perf_counter() - start)
+
+
+def bench_vi_sweep(env, n_sweeps):
+    '''
+    returns the seconds per value iteration sweep and the peak memory
+    (bytes) allocated while training. the memory is traced in a run of
+    its own, as tracing slows the sweeps down
+    '''
+    vi = ValueIteration(Car(env, 'nearest'), theta = 0, r_discount = 0.95,
+                        max_itr = n_sweeps)
+
+    start = time.perf_counter()
+    vi.train()
+    seconds = time.perf_counter() - start
+
+    tracemalloc.start()
+    vi.train()
+    peak_bytes = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    return seconds / len(vi.training_results), peak_bytes
+
+
+def bench_vi_convergence(env, sweep_mode, theta = 0.01, r_discount = 0.99):
+    '''
+    returns the number of value iteration sweeps to converge to 'theta' 
+    in the sweep mode given, and the seconds they took
+    '''
+    vi = ValueIteration(Car(env, 'nearest'), theta, r_discount, max_itr = 10000,
+                        sweep_mode = sweep_mode)
+
+    start = time.perf_counter()
+    vi.train()
+    return len(vi.training_results), time.perf_counter() - start
+
+
+def bench_ps(env, theta = 0.01, r_discount = 0.99):
+    '''
+    returns the seconds prioritized sweeping takes to converge to 'theta'
+    and its number of backups, in full sweeps' worth
+    '''
+    ps = PrioritizedSweeping(Car(env, 'nearest'), theta, r_discount, max_itr = 10000)
+
+    start = time.perf_counter()
+    ps.train()
+    return time.perf_counter() - start, ps.n_backups / env.n_states
+
+
+def bench_mr(env, theta = 0.01, r_discount = 0.99):
+    '''
+    returns the full resolution sweeps coarse-to-fine value iteration 
+    takes to converge to 'theta', the cost of all its levels in full 
+    resolution sweeps and the seconds they took
+    '''
+    mr = MultiResolutionVI(Car(env, 'nearest'), theta, r_discount, max_itr = 10000)
+
+    start = time.perf_counter()
+    mr.train()
+    seconds = time.perf_counter() - start
+    return mr.level_sweeps[1], mr.total_sweeps()[1], seconds
+
+
+def bench_pi(env, max_itr):
+    '''
+    returns the seconds policy iteration (with iterative evaluation) 
+    takes to converge and the number of iterations it took
+    '''
+    pi = PolicyIteration(Car(env, 'nearest'), theta = 0, r_discount = 0.95,
+                         max_itr = max_itr, evaluation = 'iterative')
+
+    start = time.perf_counter()
+    pi.train()
+    return time.perf_counter() - start, len(pi.training_results)
+
+
+def bench_learner(env, learner, n_episodes, max_itr, q_sparse = False):
+    '''
+    returns the training episodes per second of a QLearning/DynaQ/SARSA 
+    model (or a lambda variant) and the size (bytes) of its (dense or 
+    sparse) q_table
+    '''
+    model = learner(Car(env, 'nearest'), 0.1, 0.95, 0.99, 0.3,
+                    episodes = n_episodes, max_itr = max_itr, q_sparse = q_sparse)
+
+    start = time.perf_counter()
+    model.train()
+    seconds = time.perf_counter() - start
+
+    return n_episodes / seconds, model.q_table.nbytes
+
+
+def bench_track(env, track_path, cache_dir, n_steps, n_sweeps, n_episodes, max_itr):
+    '''
+    runs every benchmark once on a track.
+
+    return:
+    dict of metric name -> value
+    '''
+    metrics = {}
+    metrics['load_seconds'], metrics['cached_load_seconds'] = \
+        bench_load(track_path, cache_dir)
+
+    for crash_type in ('nearest', 'restart'):
+        metrics[f'car_{crash_type}_steps_per_sec'] = \
+            bench_car_steps(env, crash_type, n_steps)
+
+    metrics['vi_sweep_seconds'], metrics['vi_peak_bytes'] = \
+        bench_vi_sweep(env, n_sweeps)
+    metrics['vi_sync_sweeps_to_theta'], metrics['vi_sync_seconds_to_theta'] = \
+        bench_vi_convergence(env, 'synchronous')
+    metrics['vi_gs_sweeps_to_theta'], metrics['vi_gs_seconds_to_theta'] = \
+        bench_vi_convergence(env, 'gauss-seidel')
+    metrics['ps_seconds_to_theta'], metrics['ps_sweeps_to_theta'] = bench_ps(env)
+    metrics['mr_sweeps_to_theta'], metrics['mr_sweep_cost_to_theta'], \
+        metrics['mr_seconds_to_theta'] = bench_mr(env)
+    metrics['pi_seconds'], metrics['pi_iterations'] = bench_pi(env, n_sweeps)
+
+    metrics['ql_episodes_per_sec'], q_table_bytes = \
+        bench_learner(env, QLearning, n_episodes, max_itr)
+    metrics['sarsa_episodes_per_sec'], _ = \
+        bench_learner(env, SARSA, n_episodes, max_itr)
+    metrics['dyna_episodes_per_sec'], _ = \
+        bench_learner(env, DynaQ, n_episodes, max_itr)
+    metrics['ql_lambda_episodes_per_sec'], _ = \
+        bench_learner(env, QLambda, n_episodes, max_itr)
+    metrics['sarsa_lambda_episodes_per_sec'], _ = \
+        bench_learner(env, SARSALambda, n_episodes, max_itr)
+    metrics['ql_sparse_episodes_per_sec'], sparse_q_table_bytes = \
+        bench_learner(env, QLearning, n_episodes, max_itr, q_sparse = True)
+
+    # memory held by the env's transition tables and a q_table
+    metrics['transition_table_bytes'] = env.next_state.nbytes + \
+        env.finished.nbytes + env.crashed.nbytes
+    metrics['q_table_bytes'] = q_table_bytes
+    metrics['sparse_q_table_bytes'] = sparse_q_table_bytes
+
+    return metrics
+
+
+def run_benchmarks(track_paths, n_steps = 100000, n_sweeps = 20, n_episodes = 50,
+                   max_itr = 1000, repeats = 7, seed = 0):
+    '''
+    runs every benchmark on every track 'repeats' times, after a warm-up
+    round, and keeps the median of each metric. a round runs every track
+    once, so a slow spell of a shared machine lands on a run or two of
+    every metric (which the median drops) rather than on every run of a
+    few. each track is reseeded before every run, so the runs repeat the
+    same work.
+
+    return:
+    dict of track name -> dict of metric name -> value, and the spread of
+    the runs of each metric in the same layout (their interquartile range
+    as a fraction of the median)
+    '''
+    names = [os.path.splitext(os.path.basename(path))[0] for path in track_paths]
+    envs = [Racetrack(path) for path in track_paths]
+    runs = {name: [] for name in names}
+
+    with tempfile.TemporaryDirectory() as cache_dir:
+        for round_no in range(repeats + 1):
+            for name, env, track_path in zip(names, envs, track_paths):
+
+                set_seed(seed)
+                metrics = bench_track(env, track_path, cache_dir, n_steps,
+                                      n_sweeps, n_episodes, max_itr)
+                if round_no > 0:
+                    runs[name].append(metrics)
+
+    results, spreads = {}, {}
+    for name, track_runs in runs.items():
+        results[name], spreads[name] = {}, {}
+
+        for metric in track_runs[0]:
+            values = [run[metric] for run in track_runs]
+            results[name][metric] = median(values)
+
+            spread = 0.0
+            if len(values) > 1 and results[name][metric]:
+                q1, _, q3 = quantiles(values, n = 4)
+                spread = (q3 - q1) / results[name][metric]
+            spreads[name][metric] = spread
+
+    return results, spreads
+
+
+def compare_to_baseline(results, baseline, threshold, spreads = None):
+    '''
+    returns a list of (track, metric, baseline value, value) for every
+    metric that is worse than its baseline by more than 'threshold'
+    (a fraction of the baseline value) plus the spread of its runs, if
+    'spreads' is given: a change within the noise of the machine is not
+    a regression
+    '''
+    regressions = []
+
+    for track, metrics in results.items():
+        for metric, value in metrics.items():
+
+            base_value = baseline.get(track, {}).get(metric)
+            if not base_value:
+                continue
+
+            if metric.endswith(HIGHER_IS_BETTER):
+                change = (base_value - value) / base_value
+            else:
+                change = (value - base_value) / base_value
+
+            noise = 0.0 if spreads is None else spreads.get(track, {}).get(metric, 0.0)
+            if change > threshold + noise:
+                regressions.append((track, metric, base_value, value))
+
+    return regressions
+
+
+def main(argv = None):
+
+    parser = argparse.ArgumentParser(description = 'racetrack benchmark suite')
+    parser.add_argument('--tracks', nargs = '*', default = None,
+                        help = 'track files (default: every file in track-data)')
+    parser.add_argument('--out', default = 'benchmark-results.json',
+                        help = 'json file to write the results to')
+    parser.add_argument('--baseline', default = None,
+                        help = 'json results file to compare against')
+    parser.add_argument('--threshold', type = float, default = 0.2,
+                        help = 'allowed fractional regression vs. the baseline')
+    parser.add_argument('--save-baseline', action = 'store_true',
+                        help = 'also write the results to the --baseline file')
+    args = parser.parse_args(argv)
+
+    track_paths = args.tracks or sorted(glob.glob(os.path.join(TRACK_DIR, '*.txt')))
+    results, spreads = run_benchmarks(track_paths)
+
+    with open(args.out, 'w') as out_file:
+        json.dump(results, out_file, indent = 2)
+
+    for track, metrics in results.items():
+        print(track)
+        for metric, value in metrics.items():
+            print(f'    {metric:<30} {value:<12.6g} spread {100 * spreads[track][metric]:.0f}%')
+
+    if args.baseline is None:
+        return 0
+
+    if args.save_baseline or not os.path.exists(args.baseline):
+        with open(args.baseline, 'w') as baseline_file:
+            json.dump(results, baseline_file, indent = 2)
+        print(f'baseline written to {args.baseline}')
+        return 0
+
+    with open(args.baseline) as baseline_file:
+        baseline = json.load(baseline_file)
+
+    regressions = compare_to_baseline(results, baseline, args.threshold, spreads)
+    for track, metric, base_value, value in regressions:
+        print(f'REGRESSION {track} {metric}: {base_value:.6g} -> {value:.6g}')
+
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
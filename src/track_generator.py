@@ -0,0 +1,186 @@
+# -*- coding: utf-8 -*-
+"""
+contains functions to procedurally generate racetracks of any size in
+the track file format ('rows,cols' header line, then one line per row
+of '#', '.', 'S' and 'F' cells). a track is a corridor of fixed width
+that staircases from the top-left to the bottom-right of the map, with
+a starting line across one end and a finish line across the other.
+'downsample_track' merges the cells of a track into a coarser grid
+
+usage:
+python track_generator.py 500 500 --width 8 --turns 20 --seed 0 --out big-500.txt
+python track_generator.py 2000 2000 --width 16 --turns 60 --seed 0 --out big-2000.txt
+
+@name:          track_generator.py
+@author:        J. Tyler Leake
+@last update:   08-19-2024
+"""
+
+import numpy as np
+import argparse
+import sys
+from Racetrack import WALL, TRACK, START, FINISH, CELL_CHARS
+
+
+
+def split_length(total, n_parts, min_length, rng):
+    '''
+    randomly splits 'total' into 'n_parts' integer lengths of at least
+    'min_length' each
+    '''
+    extra = total - n_parts * min_length
+    return min_length + rng.multinomial(extra, rng.dirichlet(np.ones(n_parts)))
+
+
+def generate_track(rows, cols, width = 5, n_turns = 4, placement = 'forward',
+                   seed = None):
+    '''
+    generates a random track of 'rows' x 'cols' cells (walls included).
+
+    args:
+    width (int): width of the corridor in cells
+    n_turns (int): number of 90 degree turns along the corridor
+    placement (str): 'forward' puts the starting line at the top-left end
+                     of the corridor and the finish line at the other;
+                     'reverse' swaps them
+    seed: seed of the track layout; equal seeds give equal tracks
+
+    return:
+    np uint8 array of shape (rows, cols) of cell type codes (see
+    'Racetrack'); see 'track_to_lines' to convert it to text
+    '''
+    if placement not in ('forward', 'reverse'):
+        raise ValueError(f"unknown start/finish placement '{placement}'")
+
+    rng = np.random.default_rng(seed)
+
+    # the corridor alternates between horizontal (rightward) and vertical
+    # (downward) segments, starting with either; each segment spans at
+    # least 'width' cells so consecutive corridors never merge
+    n_segments = n_turns + 1
+    first_horizontal = bool(rng.integers(2))
+    n_horizontal = (n_segments + first_horizontal) // 2
+    n_vertical = n_segments - n_horizontal
+
+    # every segment moves the corridor's leading 'width' x 'width' block;
+    # the blocks must stay inside the one-cell wall border
+    horizontal_span = cols - 2 - width
+    vertical_span = rows - 2 - width
+    if horizontal_span < n_horizontal * width or vertical_span < n_vertical * width:
+        raise ValueError(f'a {rows}x{cols} track cannot fit {n_turns} turns '
+                         f'of a corridor {width} cells wide')
+
+    horizontal_lengths = iter(split_length(horizontal_span, n_horizontal, width, rng)) \
+                         if n_horizontal else iter(())
+    vertical_lengths = iter(split_length(vertical_span, n_vertical, width, rng)) \
+                       if n_vertical else iter(())
+
+    track = np.full((rows, cols), WALL, dtype = np.uint8)
+
+    # carve the corridor segment by segment from the top-left corner
+    X_cord, Y_cord = 1, 1
+    horizontal = first_horizontal
+
+    for _ in range(n_segments):
+
+        if horizontal:
+            length = next(horizontal_lengths)
+            track[X_cord:X_cord + width, Y_cord:Y_cord + length + width] = TRACK
+            Y_cord += length
+        else:
+            length = next(vertical_lengths)
+            track[X_cord:X_cord + length + width, Y_cord:Y_cord + width] = TRACK
+            X_cord += length
+
+        horizontal = not horizontal
+
+    last_horizontal = not horizontal
+
+    # lines across the two open ends of the corridor: at the far edge of
+    # the first and last segments (perpendicular to each)
+    if first_horizontal:
+        first_line = (slice(1, 1 + width), 1)
+    else:
+        first_line = (1, slice(1, 1 + width))
+
+    if last_horizontal:
+        last_line = (slice(X_cord, X_cord + width), Y_cord + width - 1)
+    else:
+        last_line = (X_cord + width - 1, slice(Y_cord, Y_cord + width))
+
+    start_line, finish_line = (first_line, last_line) if placement == 'forward' \
+                              else (last_line, first_line)
+    track[start_line] = START
+    track[finish_line] = FINISH
+
+    return track
+
+
+def track_to_lines(track):
+    '''
+    returns the lines of the track file of a generated track
+    '''
+    chars = CELL_CHARS[track]
+    lines = [f'{track.shape[0]},{track.shape[1]}']
+    lines.extend(''.join(row) for row in chars)
+    return lines
+
+
+def write_track(path, track):
+    '''
+    writes a generated track to 'path' in the track file format
+    '''
+    with open(path, 'w') as track_file:
+        track_file.write('\n'.join(track_to_lines(track)) + '\n')
+
+
+def downsample_track(track, factor):
+    '''
+    returns a coarse copy of a track with every 'factor' x 'factor' block
+    of cells merged into one cell: a wall if any of its cells is a wall,
+    else track. a block holding part of the start or finish line becomes
+    a start or finish cell (finish first) either way, so that the coarse
+    track keeps both lines. the track is padded with walls to a multiple
+    of 'factor'
+    '''
+    rows = -(-track.shape[0] // factor)
+    cols = -(-track.shape[1] // factor)
+
+    padded = np.full((rows * factor, cols * factor), WALL, dtype = np.uint8)
+    padded[:track.shape[0], :track.shape[1]] = track
+    blocks = padded.reshape(rows, factor, cols, factor)
+
+    coarse = np.where((blocks <= WALL).any(axis = (1, 3)), WALL, TRACK).astype(np.uint8)
+    coarse[(blocks == START).any(axis = (1, 3))] = START
+    coarse[(blocks == FINISH).any(axis = (1, 3))] = FINISH
+
+    return coarse
+
+
+def main(argv = None):
+
+    parser = argparse.ArgumentParser(description = 'racetrack generator')
+    parser.add_argument('rows', type = int, help = 'rows of the map')
+    parser.add_argument('cols', type = int, help = 'columns of the map')
+    parser.add_argument('--width', type = int, default = 5,
+                        help = 'corridor width in cells')
+    parser.add_argument('--turns', type = int, default = 4,
+                        help = 'number of turns along the corridor')
+    parser.add_argument('--placement', choices = ('forward', 'reverse'),
+                        default = 'forward', help = 'start/finish placement')
+    parser.add_argument('--seed', type = int, default = None,
+                        help = 'seed of the track layout')
+    parser.add_argument('--out', required = True, help = 'track file to write')
+    args = parser.parse_args(argv)
+
+    track = generate_track(args.rows, args.cols, args.width, args.turns,
+                           args.placement, args.seed)
+    write_track(args.out, track)
+
+    n_drivable = np.count_nonzero(track != WALL)
+    print(f'{args.out}: {args.rows}x{args.cols}, {n_drivable} drivable cells')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,57 +1,97 @@
-# -*- coding: utf-8 -*-
-"""
-contains functions used throughout the program for various
-purposes (primarily for training)
-
-@name:          utils.py
-@author:        J. Tyler Leake
-@last update:   08-19-2024
-"""
-
-import numpy as np
-import random
-
-
-
-def init_q_table(env):
-    '''
-    initializes the action value table for the algorithm 
-    with all states set to random values
-    '''
-    X_cord_dim = env.X_cord_dim
-    Y_cord_dim = env.Y_cord_dim
-    X_velo_dim = abs(env.X_velo_dim[1] - env.X_velo_dim[0])
-    Y_velo_dim = abs(env.Y_velo_dim[1] - env.Y_velo_dim[0])
-    actions_dim = len(env.actions)
-    
-    q_table = np.zeros((X_cord_dim, Y_cord_dim, X_velo_dim, Y_velo_dim, actions_dim))
-    
-    for X_cord in range(X_cord_dim):
-        for Y_cord in range(Y_cord_dim):
-            for X_velo in range(X_velo_dim):
-                for Y_velo in range(Y_velo_dim):
-                    q_table[X_cord, Y_cord, X_velo, Y_velo, :] = \
-                        np.random.rand(actions_dim)
-
-    return q_table
-    
-
-def epsilon_greedy(car, q_vals, p_explore):
-    '''
-    implements the epsilon-greedy strategy for selecting an 
-    explore vs. exploit action in the env.
-    '''
-    # randomly sample from uniform distribution; if sample is less than 
-    # exploration threshold, explore. else exploit (q_table argmax)
-    
-    if np.random.uniform(0, 1) < p_explore:            
-        action = random.choice(car.env.actions)
-        action_idx = car.env.actions.index(action)
-        q_value = q_vals[action_idx]
-        
-    else: 
-        action_idx = np.argmax(q_vals)
-        action = car.env.actions[action_idx]
-        q_value = q_vals[action_idx]
-        
-    return action, action_idx, q_value
+# -*- coding: utf-8 -*-
+"""
+contains functions used throughout the program for various
+purposes (primarily for training)
+
+@name:          utils.py
+@author:        J. Tyler Leake
+@last update:   08-19-2024
+"""
+
+import numpy as np
+import random
+from Profiler import profiler
+from SparseQTable import SparseQTable
+
+
+
+def init_q_table(env, strategy = 'random', dtype = np.float64, rng = None, 
+                 init_value = 0.0, sparse = False):
+    '''
+    initializes the action value table for the algorithm over all drivable 
+    states (keyed on the env's state id) in a single allocation. 
+    
+    args: 
+    strategy (str): 'random' draws uniform [0, 1) values; 'zeros' sets 
+                    all values to zero; 'optimistic' sets all values to 
+                    'init_value' (0 is optimistic under the -1 step reward)
+    dtype (np dtype): np.float32 or np.float64
+    rng (np.random.Generator): generator for 'random'; if none, one is 
+                               seeded from numpy's global random state
+    sparse (bool): if true, returns a 'SparseQTable' that only allocates 
+                   the values of a state on its first visit
+    '''
+    if sparse: 
+        return SparseQTable(env.n_states, len(env.actions), strategy, dtype, rng, init_value)
+    
+    shape = (env.n_states, len(env.actions))
+    
+    if strategy == 'zeros':
+        return np.zeros(shape, dtype = dtype)
+    
+    if strategy == 'optimistic':
+        return np.full(shape, init_value, dtype = dtype)
+    
+    if strategy == 'random':
+        if rng is None: 
+            rng = np.random.default_rng(np.random.randint(2**31))
+        return rng.random(shape, dtype = dtype)
+    
+    raise ValueError(f"unknown q-table initialization strategy '{strategy}'")
+    
+
+def epsilon_greedy(car, q_vals, p_explore):
+    '''
+    implements the epsilon-greedy strategy for selecting an 
+    explore vs. exploit action in the env.
+    '''
+    # randomly sample from uniform distribution; if sample is less than 
+    # exploration threshold, explore. else exploit (q_table argmax)
+    
+    if np.random.uniform(0, 1) < p_explore:            
+        if profiler.enabled: profiler.count('explore')
+        action_idx = random.randrange(len(car.env.actions))
+        action = car.env.actions[action_idx]
+        q_value = q_vals[action_idx]
+        
+    else: 
+        if profiler.enabled: profiler.count('exploit')
+        action_idx = np.argmax(q_vals)
+        action = car.env.actions[action_idx]
+        q_value = q_vals[action_idx]
+        
+    return action, action_idx, q_value
+
+
+def epsilon_greedy_idx(q_vals, p_explore):
+    '''
+    index-only form of 'epsilon_greedy' for the training loops; 
+    returns the index of the explore vs. exploit action
+    '''
+    if random.random() < p_explore:
+        if profiler.enabled: profiler.count('explore')
+        return random.randrange(len(q_vals))
+    
+    if profiler.enabled: profiler.count('exploit')
+    return q_vals.argmax().item()
+
+
+def set_seed(*entropy):
+    '''
+    seeds python's and numpy's global random generators from the entropy 
+    given (e.g. a base seed followed by run indices) so that each run 
+    is reproducible regardless of the process it executes in
+    '''
+    seed = np.random.SeedSequence(entropy).generate_state(1)[0]
+    random.seed(int(seed))
+    np.random.seed(seed)